@@ -0,0 +1,91 @@
+import copy
+import threading
+import time
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+USER_CACHE_TTL = getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+USER_CACHE_MAX_SIZE = 10000
+# результат проверки токена в CustomJWTMiddleware, чтобы DRF не проверял его повторно
+REQUEST_AUTH_ATTR = '_jwt_authentication'
+
+
+class UserCache:
+    """
+    Кэш пользователей в памяти процесса на ttl секунд по (id пользователя, jti токена).
+    Сбрасывается в CustomUser.save/delete, другие процессы видят изменения не позже ttl.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, user_id, token_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, cached_token_id, user = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            if cached_token_id != token_id:
+                return None
+        # копия, чтобы изменения request.user в одном запросе не попадали в другие
+        return copy.copy(user)
+
+    def set(self, user_id, token_id, user):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                now = time.monotonic()
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+                if len(self._entries) >= self.max_size:
+                    self._entries.clear()
+            self._entries[user_id] = (time.monotonic() + self.ttl, token_id, copy.copy(user))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def invalidate_cached_user(user_id):
+    user_cache.invalidate(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication с кэшем пользователей. Если токен уже проверен в CustomJWTMiddleware,
+    использует ее результат без повторной проверки подписи и запроса к БД.
+    """
+
+    def authenticate(self, request):
+        authenticated = getattr(getattr(request, '_request', request), REQUEST_AUTH_ATTR, None)
+        if authenticated is not None:
+            return authenticated
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        token_id = validated_token.get(api_settings.JTI_CLAIM)
+        if user_id is None or token_id is None:
+            return super().get_user(validated_token)
+
+        # в токене id может быть строкой, ключ кэша всегда строка
+        user_id = str(user_id)
+        user = user_cache.get(user_id, token_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, token_id, user)
+        return user
@@ -0,0 +1,65 @@
+import re
+import urllib.parse
+from functools import lru_cache
+
+OSU_AVATAR_HOSTS = ('a.ppy.sh', 's.ppy.sh')
+OSU_AVATAR_EXT_RE = re.compile(r'\.(png|jpg|jpeg|gif)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def validate_osu_avatar_url(avatar_url):
+    """Проверяет, что аватар лежит на серверах osu!. Результат кэшируется по url"""
+    if not avatar_url:
+        return None
+    parsed_url = urllib.parse.urlparse(avatar_url)
+    if not (parsed_url.scheme in ['http', 'https'] and
+            parsed_url.netloc in OSU_AVATAR_HOSTS):
+        return None
+    full_path = parsed_url.path + ('?' + parsed_url.query if parsed_url.query else '')
+    if not OSU_AVATAR_EXT_RE.search(full_path):
+        return None
+    return avatar_url
+
+
+def discord_avatar_url(discord_user):
+    avatar = discord_user.avatar
+    if not avatar or len(avatar) < 2:
+        return None
+    ext = '.gif' if avatar.startswith('a_') else '.png'
+    return f"https://cdn.discordapp.com/avatars/{discord_user.discord_id}/{avatar}{ext}?size=128"
+
+
+def resolve_display_nick(osu_user, custom_user):
+    """Ник для лидерборда по nick_source привязанного аккаунта"""
+    if custom_user:
+        discord_user = custom_user.discord_user
+        if custom_user.nick_source == 'osu' and custom_user.osu_user_id:
+            return osu_user.nick
+        elif custom_user.nick_source == 'discord_username' and discord_user:
+            return discord_user.nick
+        elif custom_user.nick_source == 'discord_display_name' and discord_user:
+            return discord_user.display_name
+        elif not custom_user.nick_source:
+            if custom_user.osu_user_id and osu_user.nick:
+                return osu_user.nick
+            elif discord_user and discord_user.nick:
+                return discord_user.nick
+            return None
+    return osu_user.nick if osu_user else None
+
+
+def resolve_display_avatar_url(osu_user, custom_user):
+    """Аватар для лидерборда по avatar_source привязанного аккаунта"""
+    if custom_user:
+        discord_user = custom_user.discord_user
+        if custom_user.avatar_source == 'osu' and custom_user.osu_user_id:
+            return validate_osu_avatar_url(osu_user.avatar_url)
+        elif custom_user.avatar_source == 'discord' and discord_user:
+            return discord_avatar_url(discord_user)
+        elif not custom_user.avatar_source:
+            if custom_user.osu_user_id and osu_user.avatar_url:
+                return validate_osu_avatar_url(osu_user.avatar_url)
+            elif discord_user and discord_user.avatar:
+                return discord_avatar_url(discord_user)
+        return None
+    return validate_osu_avatar_url(osu_user.avatar_url) if osu_user else None
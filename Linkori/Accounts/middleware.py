@@ -1,9 +1,8 @@
 import logging
 from django.shortcuts import redirect
-from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from .authentication import CachedJWTAuthentication, REQUEST_AUTH_ATTR
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +10,7 @@ logger = logging.getLogger(__name__)
 class CustomJWTMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        self.authenticator = CachedJWTAuthentication()
 
     def __call__(self, request):
         auth_header = request.headers.get('Authorization', '')
@@ -18,15 +18,13 @@ class CustomJWTMiddleware:
 
         if auth_header.startswith('Bearer '):
             try:
-                token = auth_header.split(' ')[1]
-                validated_token = AccessToken(token)
-                user_id = validated_token['user_id']
-                User = get_user_model()
-                user = User.objects.get(id=user_id)
-
-                request.user = user
-                request.auth = validated_token
-                logger.info(f"Authenticated user {user.identifier} via JWT")
+                authenticated = self.authenticator.authenticate(request)
+                if authenticated is not None:
+                    user, validated_token = authenticated
+                    request.user = user
+                    request.auth = validated_token
+                    setattr(request, REQUEST_AUTH_ATTR, authenticated)
+                    logger.info(f"Authenticated user {user.identifier} via JWT")
 
             except (InvalidToken, TokenError) as e:
                 logger.info(f"JWT authentication failed: {str(e)}")
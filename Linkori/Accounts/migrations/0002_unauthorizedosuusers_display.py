@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:59
+
+from django.db import migrations, models
+from Accounts.display import resolve_display_nick, resolve_display_avatar_url
+
+
+def fill_display(apps, schema_editor):
+    UnauthorizedOsuUsers = apps.get_model('Accounts', 'UnauthorizedOsuUsers')
+    CustomUser = apps.get_model('Accounts', 'CustomUser')
+    linked = {
+        custom_user.osu_user.osu_id: custom_user
+        for custom_user in CustomUser.objects.filter(osu_user__isnull=False).select_related('osu_user', 'discord_user')
+    }
+    batch = []
+    for user in UnauthorizedOsuUsers.objects.all().iterator(chunk_size=2000):
+        custom_user = linked.get(user.pk)
+        user.display_nick = resolve_display_nick(user, custom_user)
+        user.display_avatar_url = resolve_display_avatar_url(user, custom_user)
+        batch.append(user)
+        if len(batch) >= 2000:
+            UnauthorizedOsuUsers.objects.bulk_update(batch, ['display_nick', 'display_avatar_url'])
+            batch = []
+    if batch:
+        UnauthorizedOsuUsers.objects.bulk_update(batch, ['display_nick', 'display_avatar_url'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unauthorizedosuusers',
+            name='display_avatar_url',
+            field=models.URLField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='unauthorizedosuusers',
+            name='display_nick',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(fill_display, migrations.RunPython.noop),
+    ]
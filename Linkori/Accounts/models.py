@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.db import models
 from Leaderboard.regions import REGIONS, CITIES
+from .display import resolve_display_nick, resolve_display_avatar_url
 
 AVATAR_SOURCES = [
     ('osu', 'Osu!'),
@@ -13,6 +14,11 @@ NICK_SOURCES = [
 ]
 
 
+def _invalidate_cached_user(user_id):
+    from .authentication import invalidate_cached_user
+    invalidate_cached_user(user_id)
+
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, discord_id=None, osu_id=None, is_staff=False, is_superuser=False, **extra_fields):
         identifier = extra_fields.pop('identifier', None)
@@ -96,6 +102,18 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def save(self, *args, **kwargs):
         self.is_linked = bool(self.osu_user and self.discord_user)
         super().save(*args, **kwargs)
+        _invalidate_cached_user(self.pk)
+        if self.osu_user_id:
+            self.osu_user.osu.refresh_display()
+
+    def delete(self, *args, **kwargs):
+        osu = self.osu_user.osu if self.osu_user_id else None
+        user_id = self.pk
+        result = super().delete(*args, **kwargs)
+        _invalidate_cached_user(user_id)
+        if osu is not None:
+            osu.refresh_display()
+        return result
 
 
 class OsuUsers(models.Model):
@@ -112,6 +130,53 @@ class UnauthorizedOsuUsers(models.Model):
     region = models.CharField(max_length=3, choices=REGIONS, null=True)
     cities = models.CharField(max_length=3, choices=CITIES, null=True)
     last_updated = models.DateTimeField(auto_now=True)
+    # ник и аватар для лидербордов с учетом nick_source/avatar_source привязанного аккаунта,
+    # пересчитываются при записи, чтобы чтение было простой выборкой колонок
+    display_nick = models.CharField(max_length=255, null=True, blank=True)
+    display_avatar_url = models.URLField(max_length=255, null=True, blank=True)
+
+    def get_linked_user(self):
+        if not self.pk:
+            return None
+        return CustomUser.objects.filter(osu_user__osu=self).select_related('discord_user').first()
+
+    def resolve_display(self, custom_user=None):
+        """Возвращает (display_nick, display_avatar_url) для заданного привязанного аккаунта"""
+        return resolve_display_nick(self, custom_user), resolve_display_avatar_url(self, custom_user)
+
+    @classmethod
+    def unlinked(cls, **fields):
+        """Новый игрок без привязанного аккаунта для bulk_create, отображаемые поля уже рассчитаны"""
+        user = cls(**fields)
+        user.display_nick, user.display_avatar_url = user.resolve_display()
+        return user
+
+    def refresh_display(self):
+        """Пересчитывает отображаемые ник и аватар и сохраняет их, если они изменились"""
+        display = self.resolve_display(self.get_linked_user())
+        if display != (self.display_nick, self.display_avatar_url):
+            self.display_nick, self.display_avatar_url = display
+            UnauthorizedOsuUsers.objects.filter(pk=self.pk).update(
+                display_nick=self.display_nick,
+                display_avatar_url=self.display_avatar_url,
+            )
+            self._mark_leaderboard_changed()
+
+    @staticmethod
+    def _mark_leaderboard_changed():
+        # версия кэша ответов увеличивается при следующей перестройке рейтинга, а не на каждую запись
+        from Leaderboard.models import LeaderboardState
+        LeaderboardState.mark_rankings_dirty()
+
+    def save(self, *args, **kwargs):
+        self.display_nick, self.display_avatar_url = self.resolve_display(self.get_linked_user())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'display_nick', 'display_avatar_url'}
+        is_update = self.pk is not None
+        super().save(*args, **kwargs)
+        if is_update:
+            self._mark_leaderboard_changed()
 
 
 class DiscordUsers(models.Model):
@@ -121,4 +186,12 @@ class DiscordUsers(models.Model):
     avatar = models.CharField(max_length=255, null=True)
     access_token = models.CharField(max_length=255)
     refresh_token = models.CharField(max_length=255, blank=True)
-    token_expires_at = models.DateTimeField()
\ No newline at end of file
+    token_expires_at = models.DateTimeField()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        custom_user = CustomUser.objects.filter(discord_user=self, osu_user__isnull=False).select_related(
+            'osu_user__osu'
+        ).first()
+        if custom_user:
+            custom_user.osu_user.osu.refresh_display()
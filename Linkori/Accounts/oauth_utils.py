@@ -1,12 +1,40 @@
 from django.conf import settings
 from django.utils import timezone
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from .exceptions import TokenError
 from .models import UnauthorizedOsuUsers, OsuUsers, DiscordUsers
 import requests
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
+# (connect, read) для каждого запроса к osu!/Discord
+OAUTH_REQUEST_TIMEOUT = (3.05, 10)
+OAUTH_POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Общая сессия с пулом keep-alive соединений, чтобы не устанавливать TLS на каждый вход.
+    Cookies отключены: сессию делят запросы разных пользователей
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OAUTH_POOL_SIZE)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
 def process_osu_token(code, redirect_uri=None):
     token_url = 'https://osu.ppy.sh/oauth/token'
     if redirect_uri is None:
@@ -21,7 +49,7 @@ def process_osu_token(code, redirect_uri=None):
     }
 
     try:
-        response = requests.post(token_url, data=data)
+        response = get_session().post(token_url, data=data, timeout=OAUTH_REQUEST_TIMEOUT)
         if response.status_code != 200:
             error_details = response.text if response.text else f"HTTP {response.status_code}"
             logger.error(f"Failed to get osu! token: {error_details}")
@@ -45,7 +73,7 @@ def get_osu_user_data(token):
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = get_session().get(url, headers=headers, timeout=OAUTH_REQUEST_TIMEOUT)
         if response.status_code == 404:
             logger.warning(f"User not found (404 - likely banned/restricted)")
             return None
@@ -106,7 +134,10 @@ def process_discord_token(code, redirect_uri=None):
     }
 
     try:
-        response = requests.post(token_url, data=data, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        response = get_session().post(
+            token_url, data=data, headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            timeout=OAUTH_REQUEST_TIMEOUT
+        )
         if response.status_code != 200:
             error_details = response.text if response.text else f"HTTP {response.status_code}"
             logger.error(f"Failed to get Discord token: {error_details}")
@@ -130,7 +161,7 @@ def get_discord_user_data(token):
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = get_session().get(url, headers=headers, timeout=OAUTH_REQUEST_TIMEOUT)
         if response.status_code == 404:
             logger.warning(f"User not found (404)")
             return None
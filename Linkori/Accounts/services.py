@@ -1,12 +1,11 @@
 import logging
-import requests
+from django.db import transaction
 from django.http import JsonResponse
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 from .exceptions import TokenError
 from .models import CustomUser, UnauthorizedOsuUsers, DiscordUsers
-from Leaderboard.models import ServerMember
-from DiscordBot.models import DiscordServer
+from DiscordBot.tasks import sync_user_guilds
 from .oauth_utils import process_osu_token, get_osu_user_data, create_or_update_osu_user, process_discord_token, get_discord_user_data, create_or_update_discord_user
 
 logger = logging.getLogger(__name__)
@@ -29,6 +28,14 @@ def get_custom_user_by_discord_id(discord_id):
         return None
 
 
+def schedule_guild_sync(user):
+    """Ставит фоновую синхронизацию серверов Discord пользователя, не задерживая редирект"""
+    try:
+        sync_user_guilds.delay(user.pk)
+    except Exception as e:
+        logger.error(f"Failed to schedule guild sync for user {user.identifier}: {str(e)}")
+
+
 def handle_osu_callback(request):
     logger.info(f"Processing osu_callback with params: {request.GET}, Headers: {request.headers}")
     code = request.GET.get('code')
@@ -168,25 +175,7 @@ def handle_discord_callback(request):
             user.save()
             logger.info(f"Created new CustomUser for Discord user {discord_id}")
 
-        try:
-            guilds_url = 'https://discord.com/api/users/@me/guilds'
-            headers = {'Authorization': f'Bearer {token_data["access_token"]}'}
-            response = requests.get(guilds_url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                guilds_data = response.json()
-                bot_servers = set(DiscordServer.objects.values_list('server_id', flat=True))
-                for guild in guilds_data:
-                    if guild['id'] in bot_servers:
-                        server = DiscordServer.objects.get(server_id=guild['id'])
-                        ServerMember.objects.get_or_create(
-                            user=user,
-                            server=server
-                        )
-                        logger.info(f"Added ServerMember for user {user.identifier} on server {server.server_name}")
-            else:
-                logger.warning(f"Failed to fetch guilds for Discord user {discord_id}, status: {response.status_code}")
-        except requests.RequestException as e:
-            logger.error(f"Error fetching guilds for Discord user {discord_id}: {str(e)}")
+        transaction.on_commit(lambda: schedule_guild_sync(user))
 
         refresh = RefreshToken.for_user(user)
         response = JsonResponse({
@@ -1,9 +1,13 @@
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from .models import OsuUsers, DiscordUsers, UnauthorizedOsuUsers
+from .oauth_utils import get_session, OAUTH_REQUEST_TIMEOUT
 from django.utils import timezone
+from unittest import mock
 import responses
 import logging
 
@@ -302,4 +306,79 @@ class AccountsTests(TestCase):
 
         response = self.client.get(reverse('user'))
         logger.info(f"Profile response after logout: {response.status_code}")
-        self.assertEqual(response.status_code, 401)
\ No newline at end of file
+        self.assertEqual(response.status_code, 401)
+
+    def test_display_columns_follow_sources(self):
+        self.unauthorized_osu1.refresh_from_db()
+        self.assertEqual(self.unauthorized_osu1.display_nick, 'user1')
+        self.assertIsNone(self.unauthorized_osu1.display_avatar_url)
+
+        self.user1.discord_user = DiscordUsers.objects.create(
+            discord_id="11111", nick="discord1", avatar="a_hash",
+            access_token="test_access", token_expires_at=timezone.now()
+        )
+        self.user1.save()
+        access_token = str(RefreshToken.for_user(self.user1).access_token)
+        response = self.client.put(
+            reverse('user'), {'nick_source': 'discord_username', 'avatar_source': 'discord'},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {access_token}'
+        )
+        self.assertEqual(response.json()['displayed_nick'], 'discord1')
+
+        self.unauthorized_osu1.refresh_from_db()
+        self.assertEqual(self.unauthorized_osu1.display_nick, 'discord1')
+        self.assertEqual(
+            self.unauthorized_osu1.display_avatar_url,
+            'https://cdn.discordapp.com/avatars/11111/a_hash.gif?size=128'
+        )
+
+        self.user1.discord_user.nick = 'renamed'
+        self.user1.discord_user.save()
+        self.unauthorized_osu1.refresh_from_db()
+        self.assertEqual(self.unauthorized_osu1.display_nick, 'renamed')
+
+    def test_jwt_user_is_cached_until_saved(self):
+        access_token = str(RefreshToken.for_user(self.user2).access_token)
+        self.client.get(reverse('user'), HTTP_AUTHORIZATION=f'Bearer {access_token}')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user'), HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'FROM "Accounts_customuser"' in query['sql']])
+
+        self.user2.nick_source = 'discord_display_name'
+        self.user2.save()
+        response = self.client.get(reverse('user'), HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.assertEqual(response.json()['displayed_nick'], 'User2')
+
+    @responses.activate
+    @mock.patch('Accounts.services.sync_user_guilds.delay')
+    def test_discord_login_leaves_guilds_to_background_sync(self, delay):
+        responses.add(
+            responses.POST, 'https://discord.com/api/oauth2/token',
+            json={'access_token': 'new_access', 'refresh_token': 'new_refresh', 'expires_in': 604800},
+            status=200
+        )
+        responses.add(
+            responses.GET, 'https://discord.com/api/users/@me',
+            json={'id': '99999', 'username': 'new_user', 'global_name': 'NewUser', 'avatar': None},
+            status=200
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('discord_callback'), {'code': 'new_code_discord'})
+
+        self.assertEqual(response.status_code, 302)
+        new_user = User.objects.get(identifier="discord:99999")
+        delay.assert_called_once_with(new_user.pk)
+        self.assertNotIn('/users/@me/guilds', [call.request.url for call in responses.calls])
+
+    @responses.activate
+    def test_shared_oauth_session_keeps_no_cookies(self):
+        responses.add(
+            responses.GET, 'https://discord.com/api/users/@me',
+            json={}, headers={'Set-Cookie': '__dcfduid=abc; Domain=discord.com; Path=/'}
+        )
+
+        get_session().get('https://discord.com/api/users/@me', timeout=OAUTH_REQUEST_TIMEOUT)
+
+        self.assertEqual(len(get_session().cookies), 0)
@@ -9,7 +9,7 @@ from rest_framework import status
 import logging
 from django.shortcuts import redirect
 from Leaderboard.regions import REGIONS, CITIES, LINKED
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken
 from .services import handle_osu_callback, handle_discord_callback
 from .serializers import CustomUserSerializer
@@ -57,7 +57,7 @@ def osu_callback_view(request):
     state = request.GET.get('state', '')
     if state:
         try:
-            auth = JWTAuthentication()
+            auth = CachedJWTAuthentication()
             validated_token = auth.get_validated_token(state)
             request.user = auth.get_user(validated_token)
             logger.info(f"Authenticated user {request.user.identifier} via state token in osu_callback")
@@ -80,7 +80,7 @@ def discord_callback_view(request):
     state = request.GET.get('state', '')
     if state:
         try:
-            auth = JWTAuthentication()
+            auth = CachedJWTAuthentication()
             validated_token = auth.get_validated_token(state)
             request.user = auth.get_user(validated_token)
             logger.info(f"Authenticated user {request.user.identifier} via state token in discord_callback")
@@ -149,7 +149,7 @@ def get_cities(request):
 @permission_classes([AllowAny])
 def custom_token_verify_view(request):
     try:
-        authenticator = JWTAuthentication()
+        authenticator = CachedJWTAuthentication()
         header = authenticator.get_header(request)
 
         if header is None:
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DiscordbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'DiscordBot'
+
+    def ready(self):
+        from . import checks  # noqa: F401
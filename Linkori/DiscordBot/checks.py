@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_interactions_cache(app_configs, **kwargs):
+    """
+    Команды Discord отвечают из кэша позиций, который обновляет воркер Celery после пересчета
+    лидерборда. Кэш в памяти процесса эти обновления не получает
+    """
+    if not getattr(settings, 'DISCORD_PUBLIC_KEY', None):
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [Error(
+        "Discord interactions require a shared cache, but the default cache is process-local",
+        hint="Set CACHE_REDIS_URL or unset DISCORD_PUBLIC_KEY.",
+        id='DiscordBot.E001',
+    )]
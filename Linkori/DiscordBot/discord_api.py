@@ -1,18 +1,76 @@
 import requests
 import logging
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from Leaderboard.models import ServerMember
 from Accounts.models import CustomUser
+from Accounts.oauth_utils import OAUTH_REQUEST_TIMEOUT
 from .models import DiscordServer
 
 logger = logging.getLogger(__name__)
 
+BOT_GUILDS_PAGE_SIZE = 200
+GUILD_MEMBERS_PAGE_SIZE = 1000
+SERVER_SYNC_FIELDS = ['server_name', 'server_icon', 'member_count', 'is_active']
+
+
+def api_url(path):
+    """Адрес Discord API из DISCORD_API_BASE_URL, чтобы можно было подставить локальную заглушку"""
+    return f"{settings.DISCORD_API_BASE_URL.rstrip('/')}/{path.lstrip('/')}"
+
+
+def create_bot_session():
+    """Сессия бота с повторами на 429/5xx с учетом Retry-After"""
+    session = requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    session.mount('https://', HTTPAdapter(max_retries=retry))
+    session.mount('http://', HTTPAdapter(max_retries=retry))
+    return session
+
 
 class DiscordBotApi:
+    @staticmethod
+    def fetch_bot_guilds(bot_token, session=None):
+        """
+        Получает все серверы бота постранично через параметр after.
+
+        Returns:
+            list | None: серверы или None в случае ошибки
+        """
+        headers = {"Authorization": f"Bot {bot_token}"}
+        session = session or requests
+        guilds = []
+        after = None
+
+        while True:
+            params = {"with_counts": "true", "limit": BOT_GUILDS_PAGE_SIZE}
+            if after:
+                params["after"] = after
+            response = session.get(api_url('users/@me/guilds'), headers=headers, params=params, timeout=10)
+            if response.status_code != 200:
+                logger.error(f"Failed to get bot guilds: {response.status_code}, {response.text}")
+                return None
+
+            page = response.json()
+            guilds.extend(page)
+            if len(page) < BOT_GUILDS_PAGE_SIZE:
+                return guilds
+            after = page[-1]['id']
+
     @staticmethod
     def get_servers(bot_token):
         """
         Получает список серверов, на которых присутствует бот, через Discord API
-        и создает или обновляет соответствующие записи в базе данных.
+        и синхронизирует с ними DiscordServer: новые и изменившиеся строки записываются
+        одним upsert, серверы, которые бот покинул, помечаются is_active=False.
 
         Args:
             bot_token (str): Токен бота Discord
@@ -20,47 +78,51 @@ class DiscordBotApi:
         Returns:
             bool: True если операция успешна, False в случае ошибки
         """
-        bot_guilds_url = "https://discord.com/api/users/@me/guilds?with_counts=true"
-        headers = {"Authorization": f"Bot {bot_token}"}
-
         try:
-            response = requests.get(bot_guilds_url, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"Failed to get bot guilds: {response.status_code}, {response.text}")
+            guilds = DiscordBotApi.fetch_bot_guilds(bot_token)
+            if guilds is None:
                 return False
-
-            guilds = response.json()
             logger.info(f"Bot is present on {len(guilds)} servers")
 
-            created_count = 0
-            updated_count = 0
-
+            existing = {
+                server.server_id: server
+                for server in DiscordServer.objects.only(*SERVER_SYNC_FIELDS, 'server_id')
+            }
+            upserts = []
+            seen = set()
             for guild in guilds:
                 server_id = guild.get('id')
                 server_name = guild.get('name')
-                server_icon = guild.get('icon')
-                member_count = guild.get('approximate_member_count')
-
                 if not server_id or not server_name:
                     logger.warning(f"Incomplete server data: {guild}")
                     continue
+                seen.add(server_id)
 
-                server, created = DiscordServer.objects.update_or_create(
-                    server_id=server_id,
-                    defaults={
-                        'server_id': server_id,
-                        'server_name': server_name,
-                        'server_icon': server_icon,
-                        'member_count': member_count,
-                    }
-                )
+                fields = {
+                    'server_name': server_name,
+                    'server_icon': guild.get('icon'),
+                    'member_count': guild.get('approximate_member_count') or 0,
+                    'is_active': True,
+                }
+                server = existing.get(server_id)
+                if server is not None and all(getattr(server, field) == value for field, value in fields.items()):
+                    continue
+                upserts.append(DiscordServer(server_id=server_id, **fields))
 
-                if created:
-                    created_count += 1
-                else:
-                    updated_count += 1
+            created_count = sum(1 for server in upserts if server.server_id not in existing)
+            if upserts:
+                DiscordServer.objects.bulk_create(
+                    upserts,
+                    update_conflicts=True,
+                    unique_fields=['server_id'],
+                    update_fields=SERVER_SYNC_FIELDS,
+                )
+            left_count = DiscordServer.objects.filter(is_active=True).exclude(server_id__in=seen).update(is_active=False)
 
-            logger.info(f"Created {created_count} new servers, updated {updated_count} existing servers")
+            logger.info(
+                f"Created {created_count} new servers, updated {len(upserts) - created_count} existing servers, "
+                f"{left_count} servers left"
+            )
             return True
 
         except requests.RequestException as e:
@@ -68,4 +130,110 @@ class DiscordBotApi:
             return False
         except Exception as e:
             logger.error(f"Error while processing Discord servers: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def get_user_guild_ids(access_token):
+        """
+        Получает id серверов пользователя по его OAuth токену Discord.
+
+        Returns:
+            set | None: id серверов или None в случае ошибки
+        """
+        guilds_url = api_url('users/@me/guilds')
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        try:
+            response = requests.get(guilds_url, headers=headers, timeout=OAUTH_REQUEST_TIMEOUT)
+            if response.status_code != 200:
+                logger.warning(f"Failed to fetch user guilds, status: {response.status_code}")
+                return None
+            return {guild['id'] for guild in response.json() if guild.get('id')}
+        except requests.RequestException as e:
+            logger.error(f"Error fetching user guilds: {str(e)}")
+            return None
+
+    @staticmethod
+    def reconcile_memberships(user, guild_ids):
+        """
+        Приводит ServerMember пользователя к серверам бота из guild_ids:
+        недостающие добавляются одним INSERT, покинутые удаляются одним DELETE.
+
+        Returns:
+            set: server_id серверов, где состав участников изменился
+        """
+        servers = dict(
+            DiscordServer.objects.filter(server_id__in=list(guild_ids), is_active=True).values_list('server_id', 'pk')
+        )
+        current = set(ServerMember.objects.filter(user=user).values_list('server__server_id', flat=True))
+
+        joined = set(servers) - current
+        left = current - set(servers)
+        if joined:
+            ServerMember.objects.bulk_create(
+                [ServerMember(user=user, server_id=servers[server_id]) for server_id in joined],
+                ignore_conflicts=True,
+            )
+        if left:
+            ServerMember.objects.filter(user=user, server__server_id__in=left).delete()
+
+        logger.info(f"Synced guilds for user {user.identifier}: {len(joined)} joined, {len(left)} left")
+        return joined | left
+
+    @staticmethod
+    def sync_guild_members(server, bot_token, session=None):
+        """
+        Добавляет ServerMember для всех привязанных пользователей сервера по списку участников
+        /guilds/{id}/members (нужен интент GUILD_MEMBERS). Список читается страницами
+        по GUILD_MEMBERS_PAGE_SIZE, после каждой страницы сохраняется последний id участника,
+        поэтому прерванная синхронизация продолжается с него. После полного прохода
+        курсор сбрасывается.
+
+        Returns:
+            int | None: количество добавленных участников или None в случае ошибки
+        """
+        session = session or create_bot_session()
+        headers = {"Authorization": f"Bot {bot_token}"}
+        url = api_url(f'guilds/{server.server_id}/members')
+        added = 0
+
+        while True:
+            params = {"limit": GUILD_MEMBERS_PAGE_SIZE}
+            if server.members_after:
+                params["after"] = server.members_after
+            try:
+                response = session.get(url, headers=headers, params=params, timeout=10)
+            except requests.RequestException as e:
+                logger.error(f"Request error during members fetch for server {server.server_id}: {str(e)}")
+                return None
+            if response.status_code != 200:
+                logger.error(
+                    f"Failed to get members for server {server.server_id}: {response.status_code}, {response.text}"
+                )
+                return None
+
+            page = response.json()
+            member_ids = [member['user']['id'] for member in page if member.get('user')]
+            if member_ids:
+                user_ids = set(CustomUser.objects.filter(
+                    discord_user__discord_id__in=member_ids
+                ).values_list('pk', flat=True))
+                new_ids = user_ids - set(ServerMember.objects.filter(
+                    server=server, user_id__in=user_ids
+                ).values_list('user_id', flat=True))
+                if new_ids:
+                    ServerMember.objects.bulk_create(
+                        [ServerMember(user_id=user_id, server=server) for user_id in new_ids],
+                        ignore_conflicts=True,
+                    )
+                    added += len(new_ids)
+
+            if len(page) < GUILD_MEMBERS_PAGE_SIZE:
+                server.members_after = None
+                server.members_synced_at = timezone.now()
+                server.save(update_fields=['members_after', 'members_synced_at'])
+                logger.info(f"Synced members for server {server.server_id}: {added} linked members added")
+                return added
+
+            server.members_after = page[-1]['user']['id']
+            server.save(update_fields=['members_after'])
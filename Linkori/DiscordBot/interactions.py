@@ -0,0 +1,101 @@
+import logging
+from functools import lru_cache
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from django.conf import settings
+from Leaderboard.osu_api_service import GAME_MODES
+from Leaderboard.position_cache import get_server_positions
+
+logger = logging.getLogger(__name__)
+
+PING = 1
+APPLICATION_COMMAND = 2
+PONG = 1
+CHANNEL_MESSAGE_WITH_SOURCE = 4
+EPHEMERAL = 1 << 6
+
+MODE_NAMES = {'osu': 'osu!', 'taiko': 'osu!taiko', 'fruits': 'osu!catch', 'mania': 'osu!mania'}
+
+
+@lru_cache(maxsize=4)
+def _public_key(public_key_hex):
+    return Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
+
+
+def verify_signature(body, signature, timestamp):
+    """Проверяет подпись Ed25519 запроса Discord по DISCORD_PUBLIC_KEY приложения"""
+    public_key = getattr(settings, 'DISCORD_PUBLIC_KEY', None)
+    if not public_key or not signature or not timestamp:
+        return False
+    try:
+        _public_key(public_key).verify(bytes.fromhex(signature), timestamp.encode() + body)
+        return True
+    except (InvalidSignature, ValueError):
+        return False
+
+
+def message(content, ephemeral=False):
+    # упоминания только отображаются: /rank user: не должен пинговать игрока
+    data = {'content': content, 'allowed_mentions': {'parse': []}}
+    if ephemeral:
+        data['flags'] = EPHEMERAL
+    return {'type': CHANNEL_MESSAGE_WITH_SOURCE, 'data': data}
+
+
+def _options(interaction):
+    return {option['name']: option.get('value') for option in interaction.get('data', {}).get('options', [])}
+
+
+def _format_pp(pp):
+    return f"{pp or 0:.0f}pp"
+
+
+def handle_rank(interaction, server_id, mode):
+    options = _options(interaction)
+    invoker = (interaction.get('member') or {}).get('user') or interaction.get('user') or {}
+    discord_id = str(options.get('user') or invoker.get('id', ''))
+
+    scope = get_server_positions(server_id, mode)
+    position = scope['positions'].get(discord_id)
+    if position is None:
+        return message(f"<@{discord_id}> нет в лидерборде {MODE_NAMES[mode]} этого сервера", ephemeral=True)
+    place, pp = position
+    return message(f"<@{discord_id}>: #{place} из {scope['total']} в {MODE_NAMES[mode]} ({_format_pp(pp)})")
+
+
+def handle_top(interaction, server_id, mode):
+    scope = get_server_positions(server_id, mode)
+    if not scope['top']:
+        return message(f"Лидерборд {MODE_NAMES[mode]} этого сервера пока пуст", ephemeral=True)
+    lines = [f"{place}. {nick or '—'} — {_format_pp(pp)}" for place, nick, pp in scope['top']]
+    return message(f"Топ {MODE_NAMES[mode]}:\n" + '\n'.join(lines))
+
+
+COMMANDS = {
+    'rank': handle_rank,
+    'top': handle_top,
+}
+
+
+def handle_interaction(interaction):
+    """Ответ на interaction Discord. Команды отвечают из кэша позиций без пересчета лидерборда"""
+    if interaction.get('type') == PING:
+        return {'type': PONG}
+    if interaction.get('type') != APPLICATION_COMMAND:
+        return message("Неподдерживаемый тип взаимодействия", ephemeral=True)
+
+    name = interaction.get('data', {}).get('name')
+    handler = COMMANDS.get(name)
+    if handler is None:
+        logger.warning(f"Unknown interaction command {name}")
+        return message("Неизвестная команда", ephemeral=True)
+
+    server_id = interaction.get('guild_id')
+    if not server_id:
+        return message("Команда доступна только на сервере", ephemeral=True)
+
+    mode = _options(interaction).get('mode') or 'osu'
+    if mode not in GAME_MODES:
+        return message("Неизвестный режим", ephemeral=True)
+
+    return handler(interaction, server_id, mode)
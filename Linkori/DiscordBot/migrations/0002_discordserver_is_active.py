@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DiscordBot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordserver',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DiscordBot', '0002_discordserver_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordserver',
+            name='members_after',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='discordserver',
+            name='members_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DiscordBot', '0003_discordserver_members_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordserver',
+            name='refresh_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
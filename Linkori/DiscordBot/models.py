@@ -6,6 +6,13 @@ class DiscordServer(models.Model):
     server_name = models.CharField(max_length=255)
     server_icon = models.CharField(max_length=255, blank=True, null=True)
     member_count = models.IntegerField(default=0)
+    # False, если бот покинул сервер: строка остается ради истории лидерборда
+    is_active = models.BooleanField(default=True)
+    # последний обработанный id участника незавершенной синхронизации участников
+    members_after = models.CharField(max_length=255, blank=True, null=True)
+    members_synced_at = models.DateTimeField(blank=True, null=True)
+    # когда пересчет лидерборда поставлен в очередь Celery, None - задачи в очереди нет
+    refresh_queued_at = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return self.server_name
@@ -1,7 +1,7 @@
 import logging
 from celery import shared_task
 from django.conf import settings
-from .discord_api import DiscordBotApi
+from .discord_api import DiscordBotApi, create_bot_session
 from DiscordBot.models import DiscordServer
 from Accounts.models import CustomUser, DiscordUsers
 from Leaderboard.models import ServerMember
@@ -32,4 +32,70 @@ def parse_discord_servers():
         return success
     except Exception as e:
         logger.exception(f"Error while parsing Discord servers: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+@shared_task
+def sync_user_guilds(user_id):
+    """
+    Сверяет серверы пользователя с ServerMember после входа через Discord
+    и пересчитывает лидерборды серверов, где состав изменился.
+    """
+    from Leaderboard.leaderboard_service import LeaderboardService
+
+    try:
+        user = CustomUser.objects.select_related('discord_user').get(pk=user_id)
+    except CustomUser.DoesNotExist:
+        logger.warning(f"User {user_id} not found for guild sync")
+        return False
+    if not user.discord_user:
+        logger.warning(f"User {user.identifier} has no Discord account for guild sync")
+        return False
+
+    guild_ids = DiscordBotApi.get_user_guild_ids(user.discord_user.access_token)
+    if guild_ids is None:
+        return False
+
+    try:
+        changed = DiscordBotApi.reconcile_memberships(user, guild_ids)
+    except Exception as e:
+        logger.exception(f"Error while syncing guilds for user {user.identifier}: {str(e)}")
+        return False
+    LeaderboardService.schedule_refresh(changed)
+    return True
+
+
+@shared_task
+def sync_server_members(server_ids=None):
+    """
+    Добавляет в ServerMember привязанных пользователей из списков участников серверов бота
+    и пересчитывает лидерборды серверов, где появились новые участники.
+    """
+    from Leaderboard.leaderboard_service import LeaderboardService
+
+    bot_token = getattr(settings, 'DISCORD_BOT_TOKEN', None)
+    if not bot_token:
+        logger.error("DISCORD_BOT_TOKEN not found in settings")
+        return False
+
+    servers = DiscordServer.objects.filter(is_active=True)
+    if server_ids is not None:
+        servers = servers.filter(server_id__in=server_ids)
+
+    session = create_bot_session()
+    changed = []
+    failed = 0
+    for server in servers:
+        try:
+            added = DiscordBotApi.sync_guild_members(server, bot_token, session)
+        except Exception as e:
+            logger.exception(f"Error while syncing members for server {server.server_id}: {str(e)}")
+            added = None
+        if added is None:
+            failed += 1
+        elif added:
+            changed.append(server.server_id)
+
+    LeaderboardService.schedule_refresh(changed)
+    logger.info(f"Member sync finished: {len(changed)} servers got new members, {failed} failed")
+    return failed == 0
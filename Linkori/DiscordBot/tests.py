@@ -1,3 +1,216 @@
-from django.test import TestCase
+import json
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from Accounts.models import CustomUser, DiscordUsers, OsuUsers, UnauthorizedOsuUsers
+from Leaderboard.leaderboard_service import LeaderboardService
+from Leaderboard.models import ServerMember, ServerLeaderboard, OsuPerformance
+from Leaderboard.position_cache import POSITION_CACHE_MISS_TIMEOUT, position_cache_key
+from .checks import check_interactions_cache
+from .discord_api import DiscordBotApi
+from .models import DiscordServer
+from .tasks import sync_user_guilds, sync_server_members
+from unittest import mock
+import responses
 
-# Create your tests here.
+
+class GuildSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(discord_id='1')
+        self.user.discord_user = DiscordUsers.objects.create(
+            discord_id='1', nick='user', access_token='token', token_expires_at=timezone.now()
+        )
+        self.user.save()
+        self.kept = DiscordServer.objects.create(server_id='100', server_name='kept')
+        self.left = DiscordServer.objects.create(server_id='200', server_name='left')
+        self.joined = DiscordServer.objects.create(server_id='300', server_name='joined')
+        ServerMember.objects.create(user=self.user, server=self.kept)
+        ServerMember.objects.create(user=self.user, server=self.left)
+
+    @responses.activate
+    @mock.patch('Leaderboard.tasks.refresh_server_leaderboard.delay')
+    def test_sync_reconciles_memberships_in_bulk(self, delay):
+        responses.add(
+            responses.GET, 'https://discord.com/api/users/@me/guilds',
+            json=[{'id': '100'}, {'id': '300'}, {'id': '999'}]
+        )
+
+        # + выбор и отметка серверов для пересчета лидерборда
+        with self.assertNumQueries(7):
+            self.assertTrue(sync_user_guilds(self.user.pk))
+
+        self.assertEqual(
+            set(ServerMember.objects.filter(user=self.user).values_list('server__server_id', flat=True)),
+            {'100', '300'}
+        )
+        self.assertEqual({call.args[0] for call in delay.call_args_list}, {'200', '300'})
+
+    @responses.activate
+    def test_failed_guild_fetch_keeps_memberships(self):
+        responses.add(responses.GET, 'https://discord.com/api/users/@me/guilds', status=401)
+
+        self.assertFalse(sync_user_guilds(self.user.pk))
+        self.assertEqual(ServerMember.objects.filter(user=self.user).count(), 2)
+
+
+class ServerSyncTests(TestCase):
+    @responses.activate
+    @mock.patch('DiscordBot.discord_api.BOT_GUILDS_PAGE_SIZE', 2)
+    def test_pages_through_guilds_and_marks_left_servers(self):
+        DiscordServer.objects.create(server_id='1', server_name='same', member_count=10)
+        DiscordServer.objects.create(server_id='2', server_name='old name', member_count=5)
+        DiscordServer.objects.create(server_id='9', server_name='left', member_count=3)
+        url = 'https://discord.com/api/users/@me/guilds'
+        responses.add(responses.GET, url, json=[
+            {'id': '1', 'name': 'same', 'icon': None, 'approximate_member_count': 10},
+            {'id': '2', 'name': 'new name', 'icon': 'icon', 'approximate_member_count': 6},
+        ])
+        responses.add(responses.GET, url, json=[
+            {'id': '3', 'name': 'joined', 'icon': None, 'approximate_member_count': 1},
+        ])
+
+        with self.assertNumQueries(3):
+            self.assertTrue(DiscordBotApi.get_servers('token'))
+
+        self.assertIn('after=2', responses.calls[1].request.url)
+        servers = {server.server_id: server for server in DiscordServer.objects.all()}
+        self.assertEqual(servers['2'].server_name, 'new name')
+        self.assertEqual(servers['2'].member_count, 6)
+        self.assertEqual(servers['3'].server_name, 'joined')
+        self.assertFalse(servers['9'].is_active)
+        self.assertTrue(servers['1'].is_active)
+
+
+@override_settings(DISCORD_BOT_TOKEN='bot', DISCORD_API_BASE_URL='http://discord.test/api/')
+class MemberSyncTests(TestCase):
+    url = 'http://discord.test/api/guilds/100/members'
+
+    def setUp(self):
+        cache.clear()
+        self.server = DiscordServer.objects.create(server_id='100', server_name='guild')
+        self.users = []
+        for discord_id in ['1', '2', '3']:
+            user = CustomUser.objects.create_user(discord_id=discord_id)
+            user.discord_user = DiscordUsers.objects.create(
+                discord_id=discord_id, nick=f'user{discord_id}', access_token='token', token_expires_at=timezone.now()
+            )
+            user.save()
+            self.users.append(user)
+        ServerMember.objects.create(user=self.users[0], server=self.server)
+
+    @responses.activate
+    @mock.patch('DiscordBot.discord_api.GUILD_MEMBERS_PAGE_SIZE', 2)
+    @mock.patch('Leaderboard.tasks.refresh_server_leaderboard.delay')
+    def test_members_are_added_in_bulk_and_sync_resumes(self, delay):
+        responses.add(responses.GET, self.url, json=[{'user': {'id': '1'}}, {'user': {'id': '2'}}])
+        responses.add(responses.GET, self.url, status=403)
+
+        self.assertFalse(sync_server_members())
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.members_after, '2')
+        delay.assert_not_called()
+
+        responses.reset()
+        responses.add(responses.GET, self.url, json=[{'user': {'id': '3'}}, {'user': {'id': '404'}}])
+        responses.add(responses.GET, self.url, json=[])
+
+        self.assertTrue(sync_server_members())
+        self.assertIn('after=2', responses.calls[0].request.url)
+        self.assertIn('after=404', responses.calls[1].request.url)
+        self.assertEqual(ServerMember.objects.filter(server=self.server).count(), 3)
+        self.server.refresh_from_db()
+        self.assertIsNone(self.server.members_after)
+        self.assertIsNotNone(self.server.members_synced_at)
+        delay.assert_called_once_with('100')
+
+        responses.reset()
+        delay.reset_mock()
+        responses.add(responses.GET, self.url, json=[{'user': {'id': '1'}}])
+        self.assertTrue(sync_server_members())
+        delay.assert_not_called()
+
+
+PRIVATE_KEY = Ed25519PrivateKey.generate()
+PUBLIC_KEY = PRIVATE_KEY.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw).hex()
+
+
+@override_settings(DISCORD_PUBLIC_KEY=PUBLIC_KEY)
+class InteractionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = DiscordServer.objects.create(server_id='100', server_name='guild')
+        self.leaderboard = ServerLeaderboard.objects.create(server=self.server)
+        for osu_id, pp in [('1', 3000), ('2', 4000)]:
+            osu = UnauthorizedOsuUsers.objects.create(osu_id=osu_id, nick=f'p{osu_id}')
+            user = CustomUser.objects.create_user(
+                osu_id=osu_id,
+                osu_user=OsuUsers.objects.create(osu=osu, access_token='t', token_expires_at=timezone.now()),
+                discord_user=DiscordUsers.objects.create(
+                    discord_id=f'd{osu_id}', nick=f'd{osu_id}', access_token='t', token_expires_at=timezone.now()
+                ),
+            )
+            ServerMember.objects.create(user=user, server=self.server)
+            OsuPerformance.objects.create(user=osu, mode='osu', pp=pp, global_rank=int(osu_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            LeaderboardService.rebuild_server_leaderboard(self.leaderboard)
+
+    def post(self, payload, signature=None):
+        body = json.dumps(payload).encode()
+        timestamp = '1700000000'
+        if signature is None:
+            signature = PRIVATE_KEY.sign(timestamp.encode() + body).hex()
+        return self.client.post(
+            reverse('discord_interactions'), body, content_type='application/json',
+            HTTP_X_SIGNATURE_ED25519=signature, HTTP_X_SIGNATURE_TIMESTAMP=timestamp,
+        )
+
+    def command(self, name, discord_id='d1', **options):
+        return {
+            'type': 2,
+            'guild_id': '100',
+            'member': {'user': {'id': discord_id}},
+            'data': {'name': name, 'options': [{'name': key, 'value': value} for key, value in options.items()]},
+        }
+
+    def test_ping_and_signature_check(self):
+        self.assertEqual(self.post({'type': 1}).json(), {'type': 1})
+        self.assertEqual(self.post({'type': 1}, signature='00' * 64).status_code, 401)
+
+    def test_commands_are_answered_from_position_cache(self):
+        with self.assertNumQueries(0):
+            rank = self.post(self.command('rank')).json()
+            top = self.post(self.command('top', mode='osu')).json()
+
+        self.assertEqual(rank['data']['content'], '<@d1>: #2 из 2 в osu! (3000pp)')
+        self.assertEqual(rank['data']['allowed_mentions'], {'parse': []})
+        self.assertEqual(top['data']['content'], 'Топ osu!:\n1. p2 — 4000pp\n2. p1 — 3000pp')
+        missing = self.post(self.command('rank', mode='mania')).json()
+        self.assertEqual(missing['data']['flags'], 64)
+
+    @mock.patch('Leaderboard.position_cache.cache')
+    def test_positions_loaded_on_miss_expire_quickly(self, position_cache):
+        position_cache.get.return_value = None
+
+        self.post(self.command('rank'))
+
+        mapping, timeout = position_cache.set_many.call_args.args
+        self.assertEqual(timeout, POSITION_CACHE_MISS_TIMEOUT)
+        self.assertEqual(mapping[position_cache_key('100', 'osu')]['positions']['d1'], (2, 3000))
+
+
+class InteractionsCacheCheckTests(TestCase):
+    @override_settings(DISCORD_PUBLIC_KEY='key', CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    def test_interactions_require_shared_cache(self):
+        self.assertEqual([error.id for error in check_interactions_cache(None)], ['DiscordBot.E001'])
+
+    @override_settings(DISCORD_PUBLIC_KEY='key', CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}
+    })
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_interactions_cache(None), [])
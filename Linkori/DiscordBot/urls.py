@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path("interactions/", views.interactions_view, name="discord_interactions"),
+]
@@ -1,3 +1,28 @@
-from django.shortcuts import render
+import json
+import logging
+from django.http import JsonResponse, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .interactions import verify_signature, handle_interaction
 
-# Create your views here.
+logger = logging.getLogger(__name__)
+
+
+@csrf_exempt
+@require_POST
+def interactions_view(request):
+    """Endpoint interactions Discord: слэш-команды бота приходят сюда HTTP запросами"""
+    if not verify_signature(
+        request.body,
+        request.headers.get('X-Signature-Ed25519'),
+        request.headers.get('X-Signature-Timestamp'),
+    ):
+        logger.warning("Rejected Discord interaction with invalid signature")
+        return HttpResponse('invalid request signature', status=401)
+
+    try:
+        interaction = json.loads(request.body)
+    except ValueError:
+        return HttpResponse('invalid body', status=400)
+
+    return JsonResponse(handle_interaction(interaction))
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import aiohttp
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.utils import timezone
+from .models import OsuApiApplication, StatsFetchQueue, OSU_RATE_LIMIT
+from .osu_api_service import OsuApiService, OSU_BATCH_SIZE
+from .quota_manager import quota_manager, QUOTA_WINDOW_SECONDS
+
+logger = logging.getLogger(__name__)
+
+OSU_TOKEN_URL = 'https://osu.ppy.sh/oauth/token'
+OSU_USERS_URL = 'https://osu.ppy.sh/api/v2/users'
+ASYNC_REQUEST_TIMEOUT = 10
+ASYNC_MAX_IN_FLIGHT = 500
+
+
+class AsyncOsuApiService:
+    """
+    Асинхронный движок обновления статистики. Держит до max_in_flight запросов
+    одновременно, ожидание квоты и сети не занимает потоки ОС.
+    """
+
+    def __init__(self, max_in_flight=None):
+        self.max_in_flight = max_in_flight
+        self._token_locks = {}
+
+    @staticmethod
+    def quota_window():
+        """Размер окна in-flight запросов под реальную квоту всех активных приложений"""
+        active_apps = OsuApiApplication.objects.filter(is_active=True).count()
+        return max(1, min(ASYNC_MAX_IN_FLIGHT, active_apps * OSU_RATE_LIMIT))
+
+    async def _acquire_app(self, timeout=QUOTA_WINDOW_SECONDS):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            app = await sync_to_async(quota_manager.acquire_any)()
+            if app is not None:
+                return app
+            wait = await sync_to_async(quota_manager.seconds_until_available)()
+            remaining = deadline - loop.time()
+            if wait is None or remaining <= 0:
+                return None
+            await asyncio.sleep(min(max(wait, 0.05), remaining))
+
+    async def _get_token(self, session, app):
+        lock = self._token_locks.setdefault(app.pk, asyncio.Lock())
+        async with lock:
+            now = timezone.now()
+            if app.access_token and app.token_expires_at and app.token_expires_at > now + timedelta(minutes=5):
+                return app.access_token
+
+            if not await sync_to_async(quota_manager.acquire)(app):
+                logger.warning(f"Cannot get token for {app.name}: limit reached")
+                return None
+
+            data = {
+                'client_id': app.client_id,
+                'client_secret': app.client_secret,
+                'grant_type': 'client_credentials',
+                'scope': 'public'
+            }
+            try:
+                async with session.post(OSU_TOKEN_URL, data=data) as response:
+                    if response.status != 200:
+                        logger.error(f"Failed to get osu! token for {app.name}: HTTP {response.status}")
+                        await sync_to_async(quota_manager.record_error)(app)
+                        return None
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Request error getting token for {app.name}: {str(e)}")
+                await sync_to_async(quota_manager.record_error)(app)
+                return None
+
+            app.access_token = payload['access_token']
+            app.token_expires_at = now + timedelta(seconds=payload['expires_in'])
+            await sync_to_async(app.save)(update_fields=['access_token', 'token_expires_at'])
+            return app.access_token
+
+    async def fetch_users(self, session, user_ids):
+        """Асинхронный аналог OsuApiService.get_users_data"""
+        app = await self._acquire_app()
+        if app is None:
+            logger.warning(f"No quota for batch of {len(user_ids)} users")
+            return None
+
+        token = await self._get_token(session, app)
+        if token is None:
+            logger.warning(f"No token for batch users fetch with {app.name}")
+            return None
+
+        params = [('ids[]', str(user_id)) for user_id in user_ids[:OSU_BATCH_SIZE]]
+        try:
+            async with session.get(
+                OSU_USERS_URL,
+                params=params,
+                headers={'Authorization': f'Bearer {token}'}
+            ) as response:
+                if response.status != 200:
+                    logger.error(f"Failed to get batch users data: HTTP {response.status}")
+                    await sync_to_async(quota_manager.record_error)(app)
+                    return None
+                payload = await response.json()
+                return payload.get('users', [])
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Request error for batch users fetch: {str(e)}")
+            await sync_to_async(quota_manager.record_error)(app)
+            return None
+
+    async def update_batch(self, session, users, changed=None):
+        """
+        Загружает пачку игроков и применяет результат. Возвращает {osu_id: {mode: performance}}
+        или None, если пачку не удалось загрузить или сохранить
+        """
+        users_data = await self.fetch_users(session, [user.osu_id for user in users])
+        if users_data is None:
+            return None
+        return await sync_to_async(OsuApiService.apply_users_data)(users, users_data, changed)
+
+    def client_session(self, window):
+        connector = aiohttp.TCPConnector(limit=window)
+        timeout = aiohttp.ClientTimeout(total=ASYNC_REQUEST_TIMEOUT)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def update_users(self, users, changed=None):
+        window = self.max_in_flight or await sync_to_async(self.quota_window)()
+        semaphore = asyncio.Semaphore(window)
+        batches = [users[i:i + OSU_BATCH_SIZE] for i in range(0, len(users), OSU_BATCH_SIZE)]
+        logger.info(f"Starting async update for {len(users)} users in {len(batches)} batches, window {window}")
+
+        async with self.client_session(window) as session:
+            async def run(batch):
+                async with semaphore:
+                    try:
+                        return await self.update_batch(session, batch, changed)
+                    except Exception as e:
+                        logger.error(f"Error updating batch of {len(batch)} users: {str(e)}")
+                        return None
+
+            batch_results = await asyncio.gather(*(run(batch) for batch in batches))
+
+        # очередь уже очищена, новые игроки из незагруженных пачек возвращаются в нее
+        failed = [user for batch, results in zip(batches, batch_results) if results is None for user in batch]
+        if failed:
+            await sync_to_async(StatsFetchQueue.enqueue_unfetched)([user.osu_id for user in failed])
+        await sync_to_async(quota_manager.persist)()
+        return sum(len(results) for results in batch_results if results is not None)
+
+    @classmethod
+    def update_all_users_performance(cls, max_in_flight=None, changed=None):
+        users = OsuApiService.load_users_queued_first()
+        if not users:
+            logger.info("No users to update")
+            return 0
+
+        update_count = asyncio.run(cls(max_in_flight).update_users(users, changed))
+        logger.info(f"Total updated users: {update_count}")
+        return update_count
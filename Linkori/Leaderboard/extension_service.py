@@ -1,25 +1,96 @@
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
 from .regions import REGIONS
 import logging
 from Accounts.models import UnauthorizedOsuUsers
+from .models import ExtensionCrawlCheckpoint, StatsFetchQueue
 
 logger = logging.getLogger(__name__)
 
 GAME_MODES = ["osu", "taiko", "fruits", "mania"]
 
+EXTENSION_URL = "https://osuworld.octo.moe/api/RU/RU-{region}/top/{mode}?page={page}"
 REQUEST_DELAY = 0.6
+REQUEST_TIMEOUT = (5, 20)
+MAX_STREAMS = 4
+INSERT_BATCH_SIZE = 1000
+# поток без продвижения дольше этого срока считается безнадежным, начинается новый полный обход
+CHECKPOINT_MAX_AGE = timedelta(days=3)
 
-seen_ids = set()
 
-def get_all_players_from_region(region_code: str, mode: str) -> int | bool:
-    """Получает всех игроков из региона"""
+class HostRateLimiter:
+    """Вежливость к источнику: не чаще одного запроса на хост раз в min_interval секунд"""
+
+    def __init__(self, min_interval=REQUEST_DELAY):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_allowed = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            allowed = max(now, self._next_allowed.get(host, now))
+            self._next_allowed[host] = allowed + self.min_interval
+        if allowed > now:
+            time.sleep(allowed - now)
+
+
+def create_session(pool_size=MAX_STREAMS):
+    session = requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return session
+
+
+def save_new_players(player_ids, region_code: str) -> None:
+    """Добавляет новых игроков одним INSERT, уже существующие пропускаются"""
+    UnauthorizedOsuUsers.objects.bulk_create(
+        [UnauthorizedOsuUsers.unlinked(osu_id=osu_id, region=region_code) for osu_id in player_ids],
+        batch_size=INSERT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    StatsFetchQueue.enqueue_unfetched(player_ids)
+
+
+def get_all_players_from_region(region_code: str, mode: str, seen_ids: set | None = None,
+                                checkpoint: ExtensionCrawlCheckpoint | None = None,
+                                session: requests.Session | None = None,
+                                limiter: HostRateLimiter | None = None) -> int | bool:
+    """
+    Получает всех игроков из региона. seen_ids - игроки, уже обработанные за этот запуск.
+    С checkpoint обход начинается с сохраненной страницы, а прогресс сохраняется после каждой.
+    """
+    if seen_ids is None:
+        seen_ids = set()
+    session = session or create_session(1)
+    limiter = limiter or HostRateLimiter()
     players = 0
-    page = 1
+    page = checkpoint.next_page if checkpoint else 1
 
     while True:
-        url = f"https://osuworld.octo.moe/api/RU/RU-{region_code}/top/{mode}?page={page}"
-        response = requests.get(url)
+        url = EXTENSION_URL.format(region=region_code, mode=mode, page=page)
+        limiter.wait(url)
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ошибка запроса {e} | Регион: {region_code} | Режим: {mode} | Страница: {page}")
+            return False
 
         if response.status_code != 200:
             logger.error(f"Ошибка {response.status_code} | Регион: {region_code} | Режим: {mode} | Страница: {page}")
@@ -29,35 +100,91 @@ def get_all_players_from_region(region_code: str, mode: str) -> int | bool:
         if not data.get("top"):
             break
 
+        new_ids = []
         for player in data["top"]:
-            if player["id"] in seen_ids:
+            osu_id = str(player["id"])
+            if osu_id in seen_ids:
                 continue
-            seen_ids.add(player["id"])
+            seen_ids.add(osu_id)
+            new_ids.append(osu_id)
 
-            UnauthorizedOsuUsers.objects.get_or_create(
-                osu_id=player["id"],
-                defaults={
-                    "region": region_code
-                }
-            )
-            players+=1
+        if new_ids:
+            save_new_players(new_ids, region_code)
+            players += len(new_ids)
 
         page += 1
-        time.sleep(REQUEST_DELAY)
+        if checkpoint:
+            checkpoint.next_page = page
+            checkpoint.players += len(new_ids)
+            checkpoint.save(update_fields=['next_page', 'players', 'updated_at'])
 
+    if checkpoint:
+        checkpoint.completed = True
+        checkpoint.save(update_fields=['completed', 'updated_at'])
     return players
 
-def parse_extension():
+
+def load_checkpoints(regions, modes):
+    """
+    Незавершенные потоки прошлого запуска, если он был прерван, иначе новый запуск
+    со всеми потоками с первой страницы. Потоки без продвижения дольше CHECKPOINT_MAX_AGE
+    не продолжаются, чтобы постоянно падающий поток не блокировал новые обходы.
+    """
+    checkpoints = ExtensionCrawlCheckpoint.objects.filter(region__in=regions, mode__in=modes)
+    pending = list(checkpoints.filter(completed=False, updated_at__gte=timezone.now() - CHECKPOINT_MAX_AGE))
+    if pending:
+        logger.info(f"Продолжаем прерванный парсинг: осталось {len(pending)} потоков")
+        return pending
+
+    stale = checkpoints.filter(completed=False).count()
+    if stale:
+        logger.warning(f"Отказываемся от {stale} потоков без продвижения дольше {CHECKPOINT_MAX_AGE}, начинаем заново")
+    checkpoints.delete()
+    return ExtensionCrawlCheckpoint.objects.bulk_create(
+        [ExtensionCrawlCheckpoint(region=region, mode=mode) for region in regions for mode in modes]
+    )
+
+
+def parse_extension(regions=None, modes=None, max_streams=MAX_STREAMS):
+    regions = list(regions or REGIONS.keys())
+    modes = list(modes or GAME_MODES)
+    checkpoints = load_checkpoints(regions, modes)
+
+    seen_ids = set()
+    session = create_session(max_streams)
+    limiter = HostRateLimiter()
     total_players = 0
+    failed = 0
+
+    def crawl(checkpoint):
+        try:
+            return get_all_players_from_region(
+                checkpoint.region, checkpoint.mode, seen_ids, checkpoint, session, limiter
+            )
+        except Exception as e:
+            logger.error(f"Ошибка потока {checkpoint.region} | {checkpoint.mode}: {e}")
+            return False
+        finally:
+            if max_streams > 1:
+                connection.close()
+
+    if max_streams > 1:
+        with ThreadPoolExecutor(max_workers=max_streams) as executor:
+            futures = {executor.submit(crawl, checkpoint): checkpoint for checkpoint in checkpoints}
+            results = [(futures[future], future.result()) for future in as_completed(futures)]
+    else:
+        results = [(checkpoint, crawl(checkpoint)) for checkpoint in checkpoints]
+
+    for checkpoint, players in results:
+        if type(players) == bool:
+            failed += 1
+            continue
+        logger.info(f"{checkpoint.region} | {checkpoint.mode}: найдено {players} игроков")
+        total_players += players
 
-    for region in REGIONS.keys():
-        for mode in GAME_MODES:
-            logger.info(f"Парсим: {region} | {mode}...")
-            players = get_all_players_from_region(region, mode)
-            if type(players) == bool:
-                return False
-            logger.info(f"Найдено: {players} игроков")
-            total_players += players
+    if failed:
+        logger.error(f"Парсинг с расширения прерван: {failed} потоков с ошибкой, продолжим со следующего запуска")
+        return False
 
     logger.info(f"\nПарсинг с раширения завершен. Всего собрано {total_players} уникальных игроков.")
-    return True
\ No newline at end of file
+    return True
@@ -1,10 +1,12 @@
 import requests
 import csv
+import hashlib
 import re
 import logging
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from Accounts.models import UnauthorizedOsuUsers
+from .models import GoogleSheetSnapshot, StatsFetchQueue, LeaderboardState
 from .regions import CITIES, REGIONS
 
 logger = logging.getLogger(__name__)
@@ -12,70 +14,108 @@ logger = logging.getLogger(__name__)
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1phBl7gphO-fgoVSglRbwwcrtKwRbJbPIe-1HRjvy3t0/export?format=csv&gid=0#gid=0"
 
 
+OSU_LINK_RE = re.compile(r'https?://osu\.ppy\.sh/users/\d+')
+OSU_USER_ID_RE = re.compile(r'/users/(\d+)')
+REGION_ALIASES = {"ЕАО": "Еврейская автономная область"}
+REGION_CODES = {name: code for code, name in REGIONS.items()}
+CITY_CODES = {name.strip().lower(): code for code, name in CITIES}
+UPSERT_BATCH_SIZE = 500
+
+
 def extract_osu_link(profile_text: str) -> str:
     """Извлекает ссылку на профиль osu! из текста."""
-    link_match = re.search(r'https?://osu\.ppy\.sh/users/\d+', profile_text)
+    link_match = OSU_LINK_RE.search(profile_text)
     return link_match.group(0) if link_match else ""
 
 def get_osu_user_id(url):
     """Извлекает id из ссылки"""
-    match = re.search(r'/users/(\d+)', url)
+    match = OSU_USER_ID_RE.search(url)
     return match.group(1) if match else None
 
 
+def parse_row(row):
+    """Возвращает (osu_id, код региона, код города или None) или None, если строка не подходит"""
+    if len(row) < 5:
+        return None
+
+    # Столбцы: A (0) — ссылка, C (2) — ник, H (7) — город, I (8) — регион
+    profile_text = row[0].strip()
+    nick = row[2].strip()
+    city = row[7].strip() if row[3] and len(row) > 7 else ""
+    region = row[8].strip() if row[4] and len(row) > 8 else ""
+
+    profile_url = extract_osu_link(profile_text)
+    if not profile_url or not nick:
+        return None
+
+    region_code = REGION_CODES.get(REGION_ALIASES.get(region, region))
+    if not region_code:
+        return None
+    return get_osu_user_id(profile_url), region_code, CITY_CODES.get(city.lower())
+
+
+def row_hash(region_code, city_code):
+    return hashlib.sha1(f"{region_code}|{city_code or ''}".encode()).hexdigest()[:16]
+
+
+def upsert_players(rows):
+    """Создает новых игроков и обновляет регион и город существующих одним запросом на пачку"""
+    UnauthorizedOsuUsers.objects.bulk_create(
+        [
+            UnauthorizedOsuUsers.unlinked(osu_id=osu_id, region=region_code, cities=city_code)
+            for osu_id, region_code, city_code in rows
+        ],
+        batch_size=UPSERT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['osu_id'],
+        update_fields=['region', 'cities'],
+    )
+
+
 def parse_players():
-    """Парсит данные из листа parsing"""
+    """
+    Парсит данные из листа parsing. Неизменившаяся таблица пропускается по хэшу экспорта
+    без разбора строк, из изменившейся применяются только новые и измененные строки.
+    """
     session = requests.Session()
     retry = Retry(total=5, backoff_factor=2, status_forcelist=[502, 503, 504])
     session.mount('https://', HTTPAdapter(max_retries=retry))
 
     try:
+        snapshot = GoogleSheetSnapshot.objects.filter(url=SHEET_URL).first()
+        previous_hashes = snapshot.row_hashes if snapshot else {}
+
         response = session.get(SHEET_URL, timeout=15)
-        response.encoding = "utf-8"
         response.raise_for_status()
 
-        players_count = 0
-        for row in csv.reader(response.text.splitlines()):
-            if len(row) < 5:
-                continue
-
-            # Столбцы: A (0) — ссылка, C (2) — ник, H (7) — город, I (8) — регион
-            profile_text = row[0].strip()
-            nick = row[2].strip()
-            city = row[7].strip() if row[3] else ""
-            region = row[8].strip() if row[4] else ""
-
-            profile_url = extract_osu_link(profile_text)
-            if not profile_url or not nick:
-                continue
+        # хэш сырого экспорта сверяется до разбора строк
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if snapshot and snapshot.content_hash == content_hash:
+            logger.info("Google табличка не изменилась, пропускаем")
+            return True
 
-            city_normalized = city.strip().lower()
-            region_normalized = region.strip()
-            if region_normalized == "ЕАО":
-                region_normalized = "Еврейская автономная область"
-            if not region_normalized:
+        row_hashes = {}
+        changed = {}
+        for row in csv.reader(response.content.decode("utf-8").splitlines()):
+            parsed = parse_row(row)
+            if parsed is None:
                 continue
+            osu_id, region_code, city_code = parsed
+            row_hashes[osu_id] = row_hash(region_code, city_code)
+            if previous_hashes.get(osu_id) != row_hashes[osu_id]:
+                changed[osu_id] = parsed
 
-            city_code = None
-            city_name = None
-            for code, name in CITIES:
-                if city_normalized == name.strip().lower():
-                    city_code = code
-                    city_name = name
-                    break
-            defaults = {
-                "region": list(REGIONS.keys())[list(REGIONS.values()).index(region_normalized)]
-            }
-            if city_name:
-                defaults["cities"] = city_code
-            UnauthorizedOsuUsers.objects.get_or_create(
-                osu_id=get_osu_user_id(profile_url),
-                defaults=defaults
-            )
-            players_count += 1
-            if players_count % 100 == 0:
-                logger.info(f"Обработано {players_count} игроков")
+        upsert_players(changed.values())
+        StatsFetchQueue.enqueue_unfetched(changed.keys())
+        logger.info(f"Обработано {len(row_hashes)} игроков, изменено {len(changed)}")
 
+        GoogleSheetSnapshot.objects.update_or_create(
+            url=SHEET_URL,
+            defaults={'content_hash': content_hash, 'row_hashes': row_hashes}
+        )
+        if changed:
+            # рейтинг перестраивает процесс обновления статистики, здесь только помечаем его устаревшим
+            LeaderboardState.mark_rankings_dirty()
         return True
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка при парсинге google таблички: {e}")
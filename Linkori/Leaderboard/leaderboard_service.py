@@ -1,14 +1,27 @@
 import logging
+import math
+import time
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Q
 from datetime import timedelta
-from .models import ServerLeaderboard, ServerLeaderboardEntry, ServerMember, OsuPerformance
+from .models import ServerLeaderboard, ServerLeaderboardEntry, OsuPerformance
+from .osu_api_service import GAME_MODES
+from .position_cache import refresh_server_positions
 from DiscordBot.models import DiscordServer
 from Accounts.models import CustomUser
 
 logger = logging.getLogger(__name__)
 
+ENTRY_STAT_FIELDS = ['pp', 'global_rank', 'accuracy', 'playcount', 'level']
+SERVER_REFRESH_CHUNK_SIZE = 50
+SERVER_REFRESH_MAX_SHARDS = 8
+SERVER_REFRESH_REPORT_SLOWEST = 10
+# пока задача пересчета сервера стоит в очереди, повторные запросы ее не дублируют.
+# Отметка хранится в DiscordServer.refresh_queued_at, чтобы ее видели и updater, и воркер Celery
+SERVER_REFRESH_DEDUPE_TIMEOUT = 10 * 60
+
 
 def get_unauthorized_osu_user(user_id):
     user = get_object_or_404(
@@ -37,82 +50,194 @@ class LeaderboardService:
             needs_refresh = leaderboard.last_updated < time_threshold
 
         if needs_refresh:
-            LeaderboardService.update_server_leaderboard_all_modes(leaderboard)
+            # чтение никогда не пересчитывает лидерборд, пересчет уходит в фон
+            LeaderboardService.schedule_refresh([server.server_id])
 
         return leaderboard
 
+    @staticmethod
+    def affected_server_ids(osu_user_ids):
+        """server_id серверов, в которых состоят привязанные игроки с указанными UnauthorizedOsuUsers.pk"""
+        return list(DiscordServer.objects.filter(
+            members__user__osu_user__osu__in=list(osu_user_ids),
+            members__user__is_linked=True,
+            is_active=True,
+        ).values_list('server_id', flat=True).distinct())
+
+    @staticmethod
+    def schedule_refresh(server_ids):
+        """
+        Ставит фоновый пересчет лидербордов серверов в очередь Celery.
+        Серверы, пересчет которых уже стоит в очереди, пропускаются.
+        """
+        from .tasks import refresh_server_leaderboard
+
+        now = timezone.now()
+        not_queued = Q(refresh_queued_at__isnull=True) | Q(
+            refresh_queued_at__lt=now - timedelta(seconds=SERVER_REFRESH_DEDUPE_TIMEOUT)
+        )
+        servers = DiscordServer.objects.filter(server_id__in=list(server_ids)).filter(not_queued)
+        due_ids = list(servers.values_list('server_id', flat=True))
+        if not due_ids:
+            return 0
+        DiscordServer.objects.filter(server_id__in=due_ids).update(refresh_queued_at=now)
+
+        scheduled = 0
+        for server_id in due_ids:
+            try:
+                refresh_server_leaderboard.delay(server_id)
+                scheduled += 1
+            except Exception as e:
+                DiscordServer.objects.filter(server_id=server_id).update(refresh_queued_at=None)
+                logger.error(f"Failed to schedule leaderboard refresh for server {server_id}: {str(e)}")
+        return scheduled
+
+    @staticmethod
+    def schedule_refresh_for_players(osu_user_ids):
+        """Пересчитывает в фоне только лидерборды серверов, где состоят изменившиеся игроки"""
+        if not osu_user_ids:
+            return 0
+        try:
+            server_ids = LeaderboardService.affected_server_ids(osu_user_ids)
+        except Exception as e:
+            logger.error(f"Failed to find servers for {len(osu_user_ids)} changed players: {str(e)}")
+            return 0
+        if server_ids:
+            logger.info(f"Scheduling leaderboard refresh for {len(server_ids)} servers")
+        return LeaderboardService.schedule_refresh(server_ids)
+
+    @staticmethod
+    def shard_servers(chunk_size=SERVER_REFRESH_CHUNK_SIZE, max_shards=SERVER_REFRESH_MAX_SHARDS):
+        """
+        Делит все серверы на не более чем max_shards частей. Серверы раскладываются
+        по очереди от крупных к мелким, чтобы крупные гильдии не попали в одну часть.
+        """
+        server_ids = list(DiscordServer.objects.filter(is_active=True).order_by('-member_count', 'pk').values_list('server_id', flat=True))
+        if not server_ids:
+            return []
+        shards = min(max_shards, math.ceil(len(server_ids) / chunk_size))
+        return [server_ids[i::shards] for i in range(shards)]
+
+    @staticmethod
+    def refresh_servers(server_ids):
+        """Пересчитывает лидерборды серверов по очереди. Возвращает [(server_id, секунды, успех)]"""
+        timings = []
+        for server_id in server_ids:
+            started = time.monotonic()
+            try:
+                results = LeaderboardService.refresh_server(server_id)
+                success = bool(results) and all(results.values())
+            except Exception as e:
+                logger.error(f"Error refreshing leaderboard for server {server_id}: {str(e)}")
+                success = False
+            timings.append((server_id, round(time.monotonic() - started, 3), success))
+        return timings
+
+    @staticmethod
+    def refresh_server(server_id):
+        try:
+            server = DiscordServer.objects.get(server_id=server_id)
+        except DiscordServer.DoesNotExist:
+            logger.error(f"Server with ID {server_id} does not exist")
+            return None
+        # снимаем отметку до пересчета: изменения во время него поставят новую задачу
+        if server.refresh_queued_at is not None:
+            DiscordServer.objects.filter(pk=server.pk).update(refresh_queued_at=None)
+        leaderboard, _ = ServerLeaderboard.objects.get_or_create(server=server)
+        return LeaderboardService.update_server_leaderboard_all_modes(leaderboard)
+
+    @staticmethod
+    def load_member_performances(server, modes=GAME_MODES):
+        """
+        Статистика всех привязанных участников сервера по режимам одним запросом:
+        {mode: [(user_id, pp, global_rank, accuracy, playcount, level), ...]}
+        """
+        rows = OsuPerformance.objects.filter(
+            mode__in=modes,
+            user__tokens__user__server_memberships__server=server,
+            user__tokens__user__is_linked=True,
+        ).values_list('user__tokens__user__id', 'mode', *ENTRY_STAT_FIELDS)
+
+        performances = {mode: [] for mode in modes}
+        for user_id, mode, *stats in rows:
+            performances[mode].append((user_id, *stats))
+        return performances
+
+    @staticmethod
+    def rank_performances(performances):
+        """Сортирует по pp, при равенстве - по глобальному рангу"""
+        return sorted(performances, key=lambda p: (-(p[1] or 0), p[2] is None, p[2] or 0, p[0]))
+
     @staticmethod
     @transaction.atomic
-    def update_server_leaderboard(leaderboard, mode='osu'):
+    def rebuild_server_leaderboard(leaderboard, modes=GAME_MODES):
+        """Пересчитывает лидерборд и пишет только добавленные, изменившиеся и выбывшие позиции"""
+        started = time.monotonic()
         server = leaderboard.server
-        logger.info(f"Updating leaderboard for server {server.server_name} in mode {mode}")
+        performances = LeaderboardService.load_member_performances(server, modes)
 
-        members = ServerMember.objects.filter(
-            server=server,
-            user__osu_user__isnull=False,
-            user__is_linked=True
-        ).select_related('user')
+        existing = {
+            (entry.mode, entry.user_id): entry
+            for entry in leaderboard.entries.filter(mode__in=modes)
+        }
 
-        performances = []
-        for member in members:
-            try:
-                osu_user = get_unauthorized_osu_user(member.user.id)
-                performance = OsuPerformance.objects.get(user=osu_user, mode=mode)
-                performances.append({
-                    'user': member.user,
-                    'pp': performance.pp,
-                    'global_rank': performance.global_rank,
-                    'accuracy': performance.accuracy,
-                    'playcount': performance.playcount,
-                    'level': performance.level
-                })
-            except OsuPerformance.DoesNotExist:
-                continue
-
-        performances.sort(key=lambda x: x['pp'], reverse=True)
-
-        leaderboard.entries.filter(mode=mode).delete()
-
-        entries = []
-        for i, perf in enumerate(performances):
-            entry = ServerLeaderboardEntry(
-                leaderboard=leaderboard,
-                user=perf['user'],
-                position=i + 1,
-                pp=perf['pp'],
-                global_rank=perf.get('global_rank'),
-                accuracy=perf.get('accuracy'),
-                playcount=perf.get('playcount'),
-                level=perf.get('level'),
-                mode=mode
-            )
-            entries.append(entry)
+        to_create = []
+        to_update = []
+        for mode in modes:
+            ranked = LeaderboardService.rank_performances(performances[mode])
+            for position, (user_id, *stats) in enumerate(ranked, start=1):
+                fields = dict(zip(ENTRY_STAT_FIELDS, stats), position=position)
+                entry = existing.pop((mode, user_id), None)
+                if entry is None:
+                    to_create.append(ServerLeaderboardEntry(
+                        leaderboard=leaderboard, user_id=user_id, mode=mode, **fields
+                    ))
+                    continue
+                if all(getattr(entry, name) == value for name, value in fields.items()):
+                    continue
+                if entry.position != position:
+                    entry.previous_position = entry.position
+                for name, value in fields.items():
+                    setattr(entry, name, value)
+                to_update.append(entry)
 
-        if entries:
-            ServerLeaderboardEntry.objects.bulk_create(entries)
+        if existing:
+            ServerLeaderboardEntry.objects.filter(pk__in=[entry.pk for entry in existing.values()]).delete()
+        if to_update:
+            ServerLeaderboardEntry.objects.bulk_update(
+                to_update, ['position', 'previous_position', *ENTRY_STAT_FIELDS], batch_size=2000
+            )
+        if to_create:
+            ServerLeaderboardEntry.objects.bulk_create(to_create, batch_size=2000)
 
         leaderboard.last_updated = timezone.now()
-        leaderboard.save()
+        leaderboard.save(update_fields=['last_updated'])
+        transaction.on_commit(lambda: refresh_server_positions(server.server_id, modes))
 
-        logger.info(f"Updated leaderboard for server {server.server_name} with {len(entries)} entries for mode {mode}")
+        logger.info(
+            f"Updated leaderboard for server {server.server_name} for modes {', '.join(modes)}: "
+            f"{len(to_create)} added, {len(to_update)} updated, {len(existing)} removed "
+            f"in {time.monotonic() - started:.3f}s"
+        )
         return leaderboard
 
+    @staticmethod
+    def update_server_leaderboard(leaderboard, mode='osu'):
+        return LeaderboardService.rebuild_server_leaderboard(leaderboard, [mode])
+
     @staticmethod
     def update_server_leaderboard_all_modes(leaderboard):
-        modes = ['osu', 'taiko', 'fruits', 'mania']
-        results = {}
-        for mode in modes:
-            try:
-                LeaderboardService.update_server_leaderboard(leaderboard, mode)
-                results[mode] = True
-            except Exception as e:
-                logger.error(f"Error updating leaderboard for mode {mode}: {str(e)}")
-                results[mode] = False
-        return results
+        try:
+            LeaderboardService.rebuild_server_leaderboard(leaderboard)
+            success = True
+        except Exception as e:
+            logger.error(f"Error updating leaderboard for server {leaderboard.server_id}: {str(e)}")
+            success = False
+        return {mode: success for mode in GAME_MODES}
 
     @staticmethod
     def get_user_servers(user):
-        return DiscordServer.objects.filter(members__user=user)
+        return DiscordServer.objects.filter(members__user=user, is_active=True)
 
     @staticmethod
     def get_user_position(user, server_id, mode='osu'):
@@ -1,6 +1,10 @@
 import logging
 from django.core.management.base import BaseCommand
 from Leaderboard.osu_api_service import OsuApiService
+from Leaderboard.async_osu_service import AsyncOsuApiService
+from Leaderboard.refresh_scheduler import RefreshScheduler
+from Leaderboard.ranking_service import rebuild_rankings
+from Leaderboard.leaderboard_service import LeaderboardService
 from Leaderboard.models import OsuApiApplication
 from django.utils import timezone
 import os
@@ -12,6 +16,26 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Запускает обновление данных пользователей osu!'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engine',
+            choices=['threads', 'async'],
+            default='threads',
+            help='Движок загрузки: пул потоков или asyncio',
+        )
+        parser.add_argument(
+            '--scheduler',
+            choices=['adaptive', 'cycle'],
+            default='adaptive',
+            help='adaptive - приоритетная очередь по активности игроков, cycle - полные проходы по всем игрокам',
+        )
+        parser.add_argument(
+            '--max-in-flight',
+            type=int,
+            default=None,
+            help='Максимум одновременных запросов для async движка (по умолчанию по квоте)',
+        )
+
     def ensure_api_applications(self):
         """Проверяет наличие api приложений для парсинга, создает их, если не находит"""
         load_dotenv()
@@ -77,8 +101,25 @@ class Command(BaseCommand):
         try:
             self.ensure_api_applications()
 
+            engine = options['engine']
+            self.stdout.write(self.style.SUCCESS(f'Using {engine} engine, {options["scheduler"]} scheduler'))
+
+            if options['scheduler'] == 'adaptive':
+                scheduler = RefreshScheduler()
+                if engine == 'async':
+                    scheduler.run_async(options['max_in_flight'])
+                else:
+                    scheduler.run_threads()
+                return
+
             while True:
-                count = OsuApiService.update_all_users_performance()
+                changed = set()
+                if engine == 'async':
+                    count = AsyncOsuApiService.update_all_users_performance(options['max_in_flight'], changed)
+                else:
+                    count = OsuApiService.update_all_users_performance(changed)
+                rebuild_rankings()
+                LeaderboardService.schedule_refresh_for_players(changed)
                 self.stdout.write(
                     self.style.SUCCESS(f'Cycle complete, updated {count} users, sleeping 30s...')
                 )
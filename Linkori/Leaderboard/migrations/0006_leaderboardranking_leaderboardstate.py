@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0005_osuapiapplication_access_token_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ranking_generation', models.PositiveIntegerField(default=0)),
+                ('ranking_totals', models.JSONField(default=dict)),
+                ('ranking_built_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeaderboardRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.PositiveIntegerField()),
+                ('mode', models.CharField(max_length=10)),
+                ('region', models.CharField(blank=True, default='', max_length=3)),
+                ('city', models.CharField(blank=True, default='', max_length=3)),
+                ('position', models.PositiveIntegerField()),
+                ('performance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='Leaderboard.osuperformance')),
+            ],
+            options={
+                'verbose_name': 'Позиция в рейтинге',
+                'verbose_name_plural': 'Позиции в рейтинге',
+                'unique_together': {('generation', 'mode', 'region', 'city', 'position')},
+            },
+        ),
+    ]
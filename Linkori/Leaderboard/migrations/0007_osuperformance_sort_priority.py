@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0001_initial'),
+        ('Leaderboard', '0006_leaderboardranking_leaderboardstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='osuperformance',
+            name='sort_priority',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(global_rank__isnull=False, pp__gt=0, then=models.Value(1)), default=models.Value(0)), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='osuperformance',
+            index=models.Index(fields=['mode', '-sort_priority', '-pp', 'global_rank', 'id'], name='osuperformance_order_idx'),
+        ),
+    ]
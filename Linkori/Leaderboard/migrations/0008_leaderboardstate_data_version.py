@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0007_osuperformance_sort_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboardstate',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DiscordBot', '0001_initial'),
+        ('Leaderboard', '0008_leaderboardstate_data_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerLeaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('server', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard', to='DiscordBot.discordserver')),
+            ],
+            options={
+                'verbose_name': 'Лидерборд сервера',
+                'verbose_name_plural': 'Лидерборды серверов',
+            },
+        ),
+        migrations.CreateModel(
+            name='ServerLeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(default='osu', max_length=10)),
+                ('position', models.PositiveIntegerField()),
+                ('pp', models.FloatField(default=0)),
+                ('global_rank', models.IntegerField(blank=True, null=True)),
+                ('accuracy', models.FloatField(default=0)),
+                ('playcount', models.IntegerField(default=0)),
+                ('level', models.FloatField(default=0)),
+                ('leaderboard', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='Leaderboard.serverleaderboard')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='server_leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Позиция в лидерборде сервера',
+                'verbose_name_plural': 'Позиции в лидербордах серверов',
+                'indexes': [models.Index(fields=['leaderboard', 'mode', 'position'], name='serverentry_position_idx')],
+                'unique_together': {('leaderboard', 'mode', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0009_serverleaderboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverleaderboardentry',
+            name='previous_position',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0010_serverleaderboardentry_previous_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtensionCrawlCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=3)),
+                ('mode', models.CharField(max_length=10)),
+                ('next_page', models.PositiveIntegerField(default=1)),
+                ('players', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Прогресс парсинга расширения',
+                'verbose_name_plural': 'Прогресс парсинга расширения',
+                'unique_together': {('region', 'mode')},
+            },
+        ),
+    ]
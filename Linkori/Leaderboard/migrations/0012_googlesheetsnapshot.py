@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0011_extensioncrawlcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoogleSheetSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=500, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('row_hashes', models.JSONField(default=dict)),
+                ('imported_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Снимок google таблицы',
+                'verbose_name_plural': 'Снимки google таблицы',
+            },
+        ),
+    ]
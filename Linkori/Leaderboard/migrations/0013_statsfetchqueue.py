@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0002_unauthorizedosuusers_display'),
+        ('Leaderboard', '0012_googlesheetsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsFetchQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fetch_queue', to='Accounts.unauthorizedosuusers')),
+            ],
+            options={
+                'verbose_name': 'Очередь первичной загрузки',
+                'verbose_name_plural': 'Очередь первичной загрузки',
+            },
+        ),
+    ]
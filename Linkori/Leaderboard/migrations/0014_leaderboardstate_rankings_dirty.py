@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0013_statsfetchqueue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboardstate',
+            name='rankings_dirty',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0014_leaderboardstate_rankings_dirty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='osuapiapplication',
+            name='circuit_open',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboard', '0015_osuapiapplication_circuit_open'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboardstate',
+            name='ranking_rebuild_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, When, Value
 from Accounts.models import CustomUser, UnauthorizedOsuUsers
 from django.utils import timezone
 from DiscordBot.models import DiscordServer
@@ -27,6 +28,8 @@ class OsuApiApplication(models.Model):
     is_active = models.BooleanField(default=True)
     requests_count = models.IntegerField(default=0)
     error_times = models.JSONField(default=list)
+    # circuit breaker по ошибкам, ведется QuotaManager. is_active - ручной выключатель
+    circuit_open = models.BooleanField(default=False)
     reset_time = models.DateTimeField(default=timezone.now)
     access_token = models.CharField(max_length=255, blank=True)
     token_expires_at = models.DateTimeField(null=True)
@@ -34,62 +37,6 @@ class OsuApiApplication(models.Model):
     def __str__(self):
         return self.name
 
-    def reset_counter_if_needed(self):
-        now = timezone.now()
-        if (now - self.reset_time).total_seconds() > 60:
-            self.requests_count = 0
-            self.reset_time = now
-            self.save()
-            return True
-        return False
-
-    def increment_counter(self):
-        from django.db.models import F
-        from django.db import transaction
-        with transaction.atomic():
-            self = type(self).objects.select_for_update().get(pk=self.pk)
-            self.reset_counter_if_needed()
-            if self.requests_count >= OSU_RATE_LIMIT:
-                return False
-            self.requests_count = F('requests_count') + 1
-            self.save(update_fields=['requests_count'])
-            self.refresh_from_db()
-            return True
-
-    def can_make_request(self):
-        self.reset_counter_if_needed()
-        return self.requests_count < OSU_RATE_LIMIT
-
-    def get_recent_error_count(self):
-        now = timezone.now()
-        recent = []
-        for t_str in self.error_times:
-            try:
-                t = timezone.datetime.fromisoformat(t_str)
-                if (now - t).total_seconds() < OSU_ERROR_WINDOW_SECONDS:
-                    recent.append(t_str)
-            except:
-                pass
-        if len(recent) != len(self.error_times):
-            self.error_times = recent
-            self.save()
-        return len(recent)
-
-    def increment_error(self):
-        self.error_times.append(timezone.now().isoformat())
-        self.save()
-        if self.get_recent_error_count() >= OSU_ERROR_THRESHOLD:
-            self.is_active = False
-            self.save()
-            return False
-        return True
-
-    def reset_errors_if_needed(self):
-        count = self.get_recent_error_count()
-        if count < OSU_ERROR_THRESHOLD and not self.is_active:
-            self.is_active = True
-            self.save()
-
 
 class OsuPerformance(models.Model):
     """Модель для хранения данных о производительности игрока в osu!"""
@@ -107,6 +54,14 @@ class OsuPerformance(models.Model):
         ('fruits', 'osu!catch'),
         ('mania', 'osu!mania'),
     ])
+    sort_priority = models.GeneratedField(
+        expression=Case(
+            When(pp__gt=0, global_rank__isnull=False, then=Value(1)),
+            default=Value(0),
+        ),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         return f"{self.user.nick} - {self.pp}pp ({self.get_mode_display()})"
@@ -114,4 +69,127 @@ class OsuPerformance(models.Model):
     class Meta:
         verbose_name = "Рейтинг osu!"
         verbose_name_plural = "Рейтинги osu!"
-        unique_together = ('user', 'mode')
\ No newline at end of file
+        unique_together = ('user', 'mode')
+        indexes = [
+            models.Index(fields=['mode', '-sort_priority', '-pp', 'global_rank', 'id'], name='osuperformance_order_idx'),
+        ]
+
+
+class ServerLeaderboard(models.Model):
+    """Лидерборд участников Discord сервера"""
+    server = models.OneToOneField(DiscordServer, on_delete=models.CASCADE, related_name='leaderboard')
+    last_updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Leaderboard {self.server.server_name}"
+
+    class Meta:
+        verbose_name = "Лидерборд сервера"
+        verbose_name_plural = "Лидерборды серверов"
+
+
+class ServerLeaderboardEntry(models.Model):
+    """Позиция участника в лидерборде сервера для одного режима"""
+    leaderboard = models.ForeignKey(ServerLeaderboard, on_delete=models.CASCADE, related_name='entries')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='server_leaderboard_entries')
+    mode = models.CharField(max_length=10, default='osu')
+    position = models.PositiveIntegerField()
+    # позиция до последнего изменения места, для отображения движения в рейтинге
+    previous_position = models.PositiveIntegerField(null=True, blank=True)
+    pp = models.FloatField(default=0)
+    global_rank = models.IntegerField(null=True, blank=True)
+    accuracy = models.FloatField(default=0)
+    playcount = models.IntegerField(default=0)
+    level = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Позиция в лидерборде сервера"
+        verbose_name_plural = "Позиции в лидербордах серверов"
+        unique_together = ('leaderboard', 'mode', 'user')
+        indexes = [
+            models.Index(fields=['leaderboard', 'mode', 'position'], name='serverentry_position_idx'),
+        ]
+
+
+class LeaderboardState(models.Model):
+    """Единственная строка с активным поколением предрассчитанного рейтинга"""
+    ranking_generation = models.PositiveIntegerField(default=0)
+    ranking_totals = models.JSONField(default=dict)
+    ranking_built_at = models.DateTimeField(null=True, blank=True)
+    # увеличивается при любом изменении данных лидерборда, входит в ключ кэша ответов
+    data_version = models.PositiveBigIntegerField(default=0)
+    # данные изменены вне процесса обновления, рейтинг нужно перестроить
+    rankings_dirty = models.BooleanField(default=False)
+    # начало идущей перестройки рейтинга, None - перестройка не идет
+    ranking_rebuild_started_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def get(cls):
+        state, _ = cls.objects.get_or_create(pk=1)
+        return state
+
+    @classmethod
+    def mark_rankings_dirty(cls):
+        """Просит процесс обновления перестроить рейтинг при следующей проверке"""
+        if not cls.objects.filter(pk=1).update(rankings_dirty=True):
+            cls.objects.get_or_create(pk=1, defaults={'rankings_dirty': True})
+
+
+class LeaderboardRanking(models.Model):
+    """Предрассчитанная позиция игрока в лидерборде (режим, регион, город)"""
+    generation = models.PositiveIntegerField()
+    mode = models.CharField(max_length=10)
+    region = models.CharField(max_length=3, blank=True, default='')
+    city = models.CharField(max_length=3, blank=True, default='')
+    position = models.PositiveIntegerField()
+    performance = models.ForeignKey(OsuPerformance, on_delete=models.CASCADE, related_name='rankings')
+
+    class Meta:
+        verbose_name = "Позиция в рейтинге"
+        verbose_name_plural = "Позиции в рейтинге"
+        unique_together = ('generation', 'mode', 'region', 'city', 'position')
+
+
+class ExtensionCrawlCheckpoint(models.Model):
+    """Прогресс обхода osuworld по одному потоку (регион, режим) для продолжения прерванного запуска"""
+    region = models.CharField(max_length=3)
+    mode = models.CharField(max_length=10)
+    next_page = models.PositiveIntegerField(default=1)
+    players = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Прогресс парсинга расширения"
+        verbose_name_plural = "Прогресс парсинга расширения"
+        unique_together = ('region', 'mode')
+
+
+class GoogleSheetSnapshot(models.Model):
+    """Хэши последнего импортированного экспорта google таблицы для пропуска неизменившихся строк"""
+    url = models.CharField(max_length=500, unique=True)
+    content_hash = models.CharField(max_length=64)
+    row_hashes = models.JSONField(default=dict)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Снимок google таблицы"
+        verbose_name_plural = "Снимки google таблицы"
+
+
+class StatsFetchQueue(models.Model):
+    """Новые игроки без статистики, которых обновлятор загружает в первую очередь"""
+    user = models.OneToOneField(UnauthorizedOsuUsers, on_delete=models.CASCADE, related_name='fetch_queue')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Очередь первичной загрузки"
+        verbose_name_plural = "Очередь первичной загрузки"
+
+    @classmethod
+    def enqueue_unfetched(cls, osu_ids):
+        """Ставит в очередь игроков из osu_ids, у которых еще нет статистики"""
+        pks = UnauthorizedOsuUsers.objects.filter(
+            osu_id__in=list(osu_ids), osu_performances__isnull=True
+        ).values_list('pk', flat=True)
+        return len(cls.objects.bulk_create([cls(user_id=pk) for pk in pks], ignore_conflicts=True))
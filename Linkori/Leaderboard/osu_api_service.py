@@ -1,36 +1,31 @@
 import requests
 import logging
-import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
-from Accounts.models import OsuUsers, UnauthorizedOsuUsers
-from .models import OsuApiApplication, OsuPerformance
+from Accounts.models import OsuUsers, UnauthorizedOsuUsers, CustomUser
+from .models import OsuApiApplication, OsuPerformance, StatsFetchQueue, LeaderboardState
+from .quota_manager import quota_manager
 
 logger = logging.getLogger(__name__)
 
-OSU_RETRY_ATTEMPTS = 12
-OSU_RETRY_WAIT_BASE = 5
 OSU_RATE_LIMIT = 60
 MAX_WORKERS = 8
+OSU_BATCH_SIZE = 50
+OSU_IMPORT_CHUNK_SIZE = 1000
+GAME_MODES = ['osu', 'taiko', 'fruits', 'mania']
+PERFORMANCE_FIELDS = ['global_rank', 'country_rank', 'pp', 'accuracy', 'playcount', 'level']
 
 class OsuApiService:
     session = requests.Session()
 
     @staticmethod
     def get_active_api_application():
-        for attempt in range(OSU_RETRY_ATTEMPTS):
-            applications = OsuApiApplication.objects.filter(is_active=True).order_by('requests_count')
-            for app in applications:
-                app.reset_errors_if_needed()
-                if app.can_make_request():
-                    return app
-            if attempt < OSU_RETRY_ATTEMPTS - 1:
-                wait_time = OSU_RETRY_WAIT_BASE * (2 ** attempt)
-                logger.warning(f"No available API app, waiting {wait_time}s (attempt {attempt+1}/{OSU_RETRY_ATTEMPTS})")
-                time.sleep(wait_time)
-        logger.error("All API applications exhausted after retries")
-        return None
+        app = quota_manager.select_app()
+        if app is None:
+            logger.warning(f"No available API app, next slot in {quota_manager.seconds_until_available()}s")
+        return app
 
     @staticmethod
     def get_user_token():
@@ -51,14 +46,8 @@ class OsuApiService:
         if app.access_token and app.token_expires_at and app.token_expires_at > now + timedelta(minutes=5):
             return app.access_token
 
-        if not app.can_make_request():
+        if not quota_manager.acquire(app):
             logger.warning(f"Cannot get token for {app.name}: limit reached")
-            time.sleep(1)
-            return None
-
-        success = app.increment_counter()
-        if not success:
-            time.sleep(1)
             return None
 
         token_url = 'https://osu.ppy.sh/oauth/token'
@@ -78,20 +67,20 @@ class OsuApiService:
                 except ValueError:
                     error_msg = 'Invalid JSON response'
                 logger.error(f"Failed to get osu! token for {app.name}: HTTP {response.status_code}, {error_msg}")
-                app.increment_error()
+                quota_manager.record_error(app)
                 return None
             data = response.json()
             app.access_token = data['access_token']
             app.token_expires_at = now + timedelta(seconds=data['expires_in'])
-            app.save()
+            app.save(update_fields=['access_token', 'token_expires_at'])
             return app.access_token
         except requests.RequestException as e:
             logger.error(f"Request error getting token for {app.name}: {str(e)}")
-            app.increment_error()
+            quota_manager.record_error(app)
             return None
         except Exception as e:
             logger.error(f"Unexpected error getting token for {app.name}: {str(e)}")
-            app.increment_error()
+            quota_manager.record_error(app)
             return None
 
     @staticmethod
@@ -102,9 +91,8 @@ class OsuApiService:
                 logger.warning("No active app for user data fetch")
                 return None
 
-        if not app.can_make_request():
+        if not quota_manager.has_headroom(app):
             logger.warning(f"Cannot get data for user {user_id} with {app.name}: limit reached")
-            time.sleep(1)
             return None
 
         if use_user_token:
@@ -121,10 +109,8 @@ class OsuApiService:
         user_url = f'https://osu.ppy.sh/api/v2/users/{user_id}/{mode}'
 
         try:
-            success = app.increment_counter()
-            if not success:
-                logger.warning(f"Cannot increment counter for {app.name} for user {user_id}")
-                time.sleep(1)
+            if not quota_manager.acquire(app):
+                logger.warning(f"Cannot acquire quota for {app.name} for user {user_id}")
                 return None
 
             user_response = OsuApiService.session.get(
@@ -143,19 +129,90 @@ class OsuApiService:
                 except ValueError:
                     error_msg = 'Invalid JSON response'
                 logger.error(f"Failed to get user data for {user_id}: HTTP {user_response.status_code}, {error_msg}")
-                app.increment_error()
+                quota_manager.record_error(app)
                 return None
 
             return user_response.json()
         except requests.RequestException as e:
             logger.error(f"Request error for user {user_id}: {str(e)}")
-            app.increment_error()
+            quota_manager.record_error(app)
             return None
         except Exception as e:
             logger.error(f"Unexpected error for user {user_id}: {str(e)}")
-            app.increment_error()
+            quota_manager.record_error(app)
+            return None
+
+    @staticmethod
+    def get_users_data(user_ids, app=None, reserved=False):
+        """
+        Получает данные до OSU_BATCH_SIZE игроков одним запросом, включая статистику всех режимов.
+        reserved - запрос уже зарезервирован в квоте app (quota_manager.wait_for_app)
+        """
+        if app is None:
+            app = OsuApiService.get_active_api_application()
+            if app is None:
+                logger.warning("No active app for batch users fetch")
+                return None
+
+        if not reserved and not quota_manager.has_headroom(app):
+            logger.warning(f"Cannot get batch of {len(user_ids)} users with {app.name}: limit reached")
             return None
 
+        token = OsuApiService.get_client_credentials_token(app)
+        if token is None:
+            logger.warning(f"No token for batch users fetch with {app.name}")
+            return None
+
+        users_url = 'https://osu.ppy.sh/api/v2/users'
+        params = [('ids[]', user_id) for user_id in user_ids[:OSU_BATCH_SIZE]]
+
+        try:
+            if not reserved and not quota_manager.acquire(app):
+                logger.warning(f"Cannot acquire quota for {app.name} for batch users fetch")
+                return None
+
+            response = OsuApiService.session.get(
+                users_url,
+                params=params,
+                headers={'Authorization': f'Bearer {token}'},
+                timeout=10
+            )
+
+            if response.status_code != 200:
+                try:
+                    resp_data = response.json()
+                    error_msg = resp_data.get('error', 'Unknown error')
+                except ValueError:
+                    error_msg = 'Invalid JSON response'
+                logger.error(f"Failed to get batch users data: HTTP {response.status_code}, {error_msg}")
+                quota_manager.record_error(app)
+                return None
+
+            return response.json().get('users', [])
+        except requests.RequestException as e:
+            logger.error(f"Request error for batch users fetch: {str(e)}")
+            quota_manager.record_error(app)
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error for batch users fetch: {str(e)}")
+            quota_manager.record_error(app)
+            return None
+
+    @staticmethod
+    def _performance_fields(statistics):
+        return {
+            'global_rank': statistics.get('global_rank'),
+            'country_rank': statistics.get('country_rank'),
+            'pp': statistics.get('pp') or 0,
+            'accuracy': statistics.get('hit_accuracy') or 0,
+            'playcount': statistics.get('play_count') or 0,
+            'level': (statistics.get('level') or {}).get('current', 0),
+        }
+
+    @staticmethod
+    def _performance_changed(performance, fields):
+        return any(getattr(performance, field) != value for field, value in fields.items())
+
     @classmethod
     def update_user_performance(cls, user, app=None, mode="osu"):
         logger.debug(f"Updating performance for user {user.osu_id} mode {mode} with app {app.name if app else 'None'}")
@@ -167,26 +224,16 @@ class OsuApiService:
         statistics = osu_data.get('statistics', {})
 
         try:
+            fields = cls._performance_fields(statistics)
             performance, created = OsuPerformance.objects.get_or_create(
                 user=user,
                 mode=mode,
-                defaults={
-                    'global_rank': statistics.get('global_rank'),
-                    'country_rank': statistics.get('country_rank'),
-                    'pp': statistics.get('pp', 0),
-                    'accuracy': statistics.get('hit_accuracy', 0),
-                    'playcount': statistics.get('play_count', 0),
-                    'level': statistics.get('level', {}).get('current', 0),
-                }
+                defaults=fields
             )
 
-            if not created:
-                performance.global_rank = statistics.get('global_rank')
-                performance.country_rank = statistics.get('country_rank')
-                performance.pp = statistics.get('pp', 0)
-                performance.accuracy = statistics.get('hit_accuracy', 0)
-                performance.playcount = statistics.get('play_count', 0)
-                performance.level = statistics.get('level', {}).get('current', 0)
+            if not created and cls._performance_changed(performance, fields):
+                for field, value in fields.items():
+                    setattr(performance, field, value)
                 performance.save()
 
             logger.info(f"Updated performance for {user.osu_id} mode {mode}: {performance.pp}pp")
@@ -195,6 +242,107 @@ class OsuApiService:
             logger.error(f"Error saving performance for {user.osu_id} mode {mode}: {str(e)}")
             return None
 
+    @classmethod
+    def apply_users_data(cls, users, users_data, changed=None):
+        """
+        Обновляет ник, аватар и OsuPerformance всех режимов для пачки игроков
+        по ответу /users. Неизменившиеся строки не пишутся, изменившиеся сохраняются
+        одним upsert на пачку. Возвращает {osu_id: {mode: performance}} для найденных игроков
+        или None, если сохранить пачку не удалось. pk игроков с изменениями добавляются
+        в множество changed.
+        """
+        data_by_id = {str(data['id']): data for data in users_data if data.get('id') is not None}
+        existing = {
+            (performance.user_id, performance.mode): performance
+            for performance in OsuPerformance.objects.filter(user__in=users)
+        }
+        now = timezone.now()
+        results = {}
+        changed_users = []
+        changed_performances = []
+
+        for user in users:
+            data = data_by_id.get(str(user.osu_id))
+            if data is None:
+                logger.warning(f"User {user.osu_id} missing from batch response (restricted or deleted?)")
+                continue
+
+            nick = data.get('username', user.nick)
+            avatar_url = data.get('avatar_url')
+            if nick != user.nick or avatar_url != user.avatar_url:
+                user.nick = nick
+                user.avatar_url = avatar_url
+                user.last_updated = now
+                changed_users.append(user)
+
+            rulesets = data.get('statistics_rulesets') or {}
+            performances = {}
+            for mode in GAME_MODES:
+                fields = cls._performance_fields(rulesets.get(mode) or {})
+                performance = existing.get((user.pk, mode))
+                if performance is not None and not cls._performance_changed(performance, fields):
+                    performances[mode] = performance
+                    continue
+                performance = OsuPerformance(
+                    pk=performance.pk if performance else None,
+                    user=user,
+                    mode=mode,
+                    **fields
+                )
+                changed_performances.append(performance)
+                performances[mode] = performance
+            results[user.osu_id] = performances
+
+        try:
+            if changed_users:
+                linked = {
+                    custom_user.osu_user.osu_id: custom_user
+                    for custom_user in CustomUser.objects.filter(
+                        osu_user__osu__in=changed_users
+                    ).select_related('osu_user', 'discord_user')
+                }
+                for user in changed_users:
+                    user.display_nick, user.display_avatar_url = user.resolve_display(linked.get(user.pk))
+            with transaction.atomic():
+                if changed_users:
+                    UnauthorizedOsuUsers.objects.bulk_update(
+                        changed_users, ['nick', 'avatar_url', 'display_nick', 'display_avatar_url', 'last_updated']
+                    )
+                if changed_performances:
+                    OsuPerformance.objects.bulk_create(
+                        changed_performances,
+                        update_conflicts=True,
+                        unique_fields=['user', 'mode'],
+                        update_fields=PERFORMANCE_FIELDS + ['last_updated'],
+                    )
+        except Exception as e:
+            logger.error(f"Error saving batch of {len(users)} users: {str(e)}")
+            return None
+
+        if changed is not None:
+            changed.update(user.pk for user in changed_users)
+            changed.update(performance.user_id for performance in changed_performances)
+
+        logger.debug(
+            f"Batch of {len(users)} users: {len(changed_users)} profiles and "
+            f"{len(changed_performances)} performances changed"
+        )
+        return results
+
+    @classmethod
+    def update_users_batch(cls, users, app=None, changed=None):
+        """Обновляет все режимы для пачки до OSU_BATCH_SIZE игроков за один запрос к API"""
+        users_data = cls.get_users_data([user.osu_id for user in users], app)
+        if users_data is None:
+            logger.warning(f"Failed to get batch data for {len(users)} users")
+            return {}
+
+        results = cls.apply_users_data(users, users_data, changed)
+        if results is None:
+            return {}
+        logger.info(f"Updated {len(results)}/{len(users)} users from batch")
+        return results
+
     @classmethod
     def update_all_modes_for_user(cls, user):
         logger.info(f"Starting all modes update for user {user.osu_id}")
@@ -203,85 +351,162 @@ class OsuApiService:
             logger.warning(f"No app for user {user.osu_id}")
             return {}
 
-        osu_data = cls.get_user_data(user.osu_id, app, mode='osu')
-        if osu_data is None:
+        performances = cls.update_users_batch([user], app).get(user.osu_id)
+        if performances is None:
             logger.warning(f"Failed to get base data for user {user.osu_id}")
             return {}
 
-        try:
-            user.nick = osu_data.get('username', user.nick)
-            user.avatar_url = osu_data.get('avatar_url')
-            user.save()
-            logger.debug(f"Updated nick/avatar for {user.osu_id}")
-        except Exception as e:
-            logger.error(f"Error saving user {user.osu_id}: {str(e)}")
-
         results = {}
-        modes = ['osu', 'taiko', 'fruits', 'mania']
-
-        for mode in modes:
-            try:
-                performance = cls.update_user_performance(user, app, mode)
-                results[mode] = {
-                    'success': performance is not None,
-                    'pp': performance.pp if performance else 0
-                }
-            except Exception as e:
-                logger.error(f"Error updating mode {mode} for {user.osu_id}: {str(e)}")
-                results[mode] = {'success': False, 'error': str(e)}
+        for mode in GAME_MODES:
+            performance = performances.get(mode)
+            results[mode] = {
+                'success': performance is not None,
+                'pp': performance.pp if performance else 0
+            }
 
         return results
 
     @classmethod
-    def _update_single_user(cls, user):
+    def _update_batch(cls, users, changed=None):
+        """Обновляет пачку с ожиданием квоты. None, если пачку не удалось загрузить или сохранить"""
         try:
-            cls.update_all_modes_for_user(user)
-            return 1
+            app = quota_manager.wait_for_app()
+            if app is None:
+                logger.warning(f"No quota for batch of {len(users)} users")
+                return None
+            users_data = cls.get_users_data([user.osu_id for user in users], app, reserved=True)
+            if users_data is None:
+                logger.warning(f"Failed to get batch data for {len(users)} users")
+                return None
+            return cls.apply_users_data(users, users_data, changed)
         except Exception as e:
-            logger.error(f"Error updating single user {user.osu_id}: {str(e)}")
-            return 0
+            logger.error(f"Error updating batch of {len(users)} users: {str(e)}")
+            return None
+
+    @staticmethod
+    def load_users_queued_first():
+        """Все игроки, новые из StatsFetchQueue - в начале списка. Очередь очищается"""
+        queued = list(StatsFetchQueue.objects.values_list('pk', 'user_id'))
+        queued_users = {user_id for _, user_id in queued}
+        users = list(UnauthorizedOsuUsers.objects.all())
+        users.sort(key=lambda user: user.pk not in queued_users)
+        if queued:
+            StatsFetchQueue.objects.filter(pk__in=[queue_pk for queue_pk, _ in queued]).delete()
+        return users
 
     @classmethod
-    def update_all_users_performance(cls):
+    def update_all_users_performance(cls, changed=None):
+        """Полный проход по всем игрокам. В changed попадают pk игроков с изменившимися данными"""
         apps = list(OsuApiApplication.objects.filter(is_active=True))
         if not apps:
             logger.error("No active apps for parsing user stats")
             return 0
 
-        users = list(UnauthorizedOsuUsers.objects.all())
+        users = cls.load_users_queued_first()
         if not users:
             logger.info("No users to update")
             return 0
 
-        logger.info(f"Starting update for {len(users)} users with {len(apps)} apps")
+        batches = [users[i:i + OSU_BATCH_SIZE] for i in range(0, len(users), OSU_BATCH_SIZE)]
+        logger.info(f"Starting update for {len(users)} users in {len(batches)} batches with {len(apps)} apps")
 
         num_workers = min(MAX_WORKERS, len(apps) * 2)
         update_count = 0
+        failed = []
         with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            futures = [executor.submit(cls._update_single_user, user) for user in users]
+            futures = {executor.submit(cls._update_batch, batch, changed): batch for batch in batches}
             for future in as_completed(futures):
                 try:
-                    count = future.result()
-                    update_count += count
+                    results = future.result()
                 except Exception as e:
                     logger.error(f"Future error: {str(e)}")
+                    results = None
+                if results is None:
+                    failed.extend(futures[future])
+                    continue
+                update_count += len(results)
+
+        # очередь уже очищена, новые игроки из незагруженных пачек возвращаются в нее
+        if failed:
+            StatsFetchQueue.enqueue_unfetched(user.osu_id for user in failed)
 
+        quota_manager.persist()
         logger.info(f"Total updated users: {update_count}")
         return update_count
 
     @classmethod
-    def update_from_osu_ids_list(cls, osu_ids, modes=['osu']):
-        update_count = 0
+    def update_from_osu_ids_list(cls, osu_ids, modes=['osu'], max_workers=MAX_WORKERS):
+        """
+        Массовый импорт по списку osu id: создает недостающих игроков одним INSERT и загружает
+        статистику пачками параллельно через менеджер квот.
+        Возвращает отчет {osu_id: {'created', 'status', 'pp'}}, status - updated, not_found,
+        failed или invalid.
+        """
+        report = {}
+        valid_ids = []
         for osu_id in osu_ids:
-            try:
-                user_obj, created = UnauthorizedOsuUsers.objects.get_or_create(
-                    osu_id=osu_id,
-                    defaults={'nick': str(osu_id)}
-                )
-                for mode in modes:
-                    cls.update_user_performance(user_obj, None, mode)
-                update_count += 1
-            except Exception as e:
-                logger.error(f"Error updating from ID {osu_id}: {str(e)}")
+            osu_id = str(osu_id).strip()
+            if osu_id in report:
+                continue
+            if not osu_id.isdigit():
+                report[osu_id] = {'created': False, 'status': 'invalid', 'pp': {}}
+                continue
+            report[osu_id] = {'created': False, 'status': 'failed', 'pp': {}}
+            valid_ids.append(osu_id)
+
+        users = []
+        for i in range(0, len(valid_ids), OSU_IMPORT_CHUNK_SIZE):
+            chunk = valid_ids[i:i + OSU_IMPORT_CHUNK_SIZE]
+            existing = set(UnauthorizedOsuUsers.objects.filter(osu_id__in=chunk).values_list('osu_id', flat=True))
+            UnauthorizedOsuUsers.objects.bulk_create(
+                [
+                    UnauthorizedOsuUsers.unlinked(osu_id=osu_id, nick=osu_id)
+                    for osu_id in chunk if osu_id not in existing
+                ],
+                ignore_conflicts=True,
+            )
+            for osu_id in chunk:
+                report[osu_id]['created'] = osu_id not in existing
+            users.extend(UnauthorizedOsuUsers.objects.filter(osu_id__in=chunk))
+
+        batches = [users[i:i + OSU_BATCH_SIZE] for i in range(0, len(users), OSU_BATCH_SIZE)]
+        logger.info(f"Importing {len(users)} users from ids list in {len(batches)} batches")
+
+        changed = set()
+        batch_results = []
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(cls._update_batch, batch, changed): batch for batch in batches}
+                for future in as_completed(futures):
+                    try:
+                        batch_results.append((futures[future], future.result()))
+                    except Exception as e:
+                        logger.error(f"Future error: {str(e)}")
+        else:
+            batch_results = [(batch, cls._update_batch(batch, changed)) for batch in batches]
+
+        for batch, results in batch_results:
+            if results is None:
+                continue
+            for user in batch:
+                performances = results.get(user.osu_id)
+                if performances is None:
+                    report[user.osu_id]['status'] = 'not_found'
+                    continue
+                report[user.osu_id]['status'] = 'updated'
+                report[user.osu_id]['pp'] = {
+                    mode: performances[mode].pp for mode in modes if mode in performances
+                }
 
-        return update_count
\ No newline at end of file
+        quota_manager.persist()
+        StatsFetchQueue.enqueue_unfetched(
+            osu_id for osu_id, result in report.items() if result['status'] == 'failed'
+        )
+        if changed:
+            from .leaderboard_service import LeaderboardService
+            LeaderboardService.schedule_refresh_for_players(changed)
+            LeaderboardState.mark_rankings_dirty()
+
+        updated = sum(1 for result in report.values() if result['status'] == 'updated')
+        logger.info(f"Imported {updated}/{len(report)} users from ids list")
+        return report
@@ -0,0 +1,62 @@
+import logging
+from django.core.cache import cache
+from .models import ServerLeaderboardEntry
+from .osu_api_service import GAME_MODES
+
+logger = logging.getLogger(__name__)
+
+POSITION_CACHE_TIMEOUT = 24 * 60 * 60
+# кэш должен быть общим для веб-процесса и воркеров Celery (DiscordBot.E001);
+# записи, загруженные при промахе, все равно живут недолго
+POSITION_CACHE_MISS_TIMEOUT = 60
+POSITION_CACHE_TOP_SIZE = 10
+
+
+def position_cache_key(server_id, mode):
+    return f'leaderboard:server_positions:{server_id}:{mode}'
+
+
+def load_server_positions(server_id, modes=GAME_MODES):
+    """
+    Позиции лидерборда сервера одним запросом:
+    {mode: {'total', 'positions': {discord_id: (position, pp)}, 'top': [(position, nick, pp), ...]}}
+    """
+    rows = ServerLeaderboardEntry.objects.filter(
+        leaderboard__server__server_id=server_id,
+        mode__in=modes,
+    ).order_by('mode', 'position').values_list(
+        'mode', 'position', 'pp', 'user__discord_user__discord_id', 'user__osu_user__osu__display_nick'
+    )
+
+    positions = {mode: {'total': 0, 'positions': {}, 'top': []} for mode in modes}
+    for mode, position, pp, discord_id, nick in rows:
+        scope = positions[mode]
+        scope['total'] += 1
+        if discord_id:
+            scope['positions'][discord_id] = (position, pp)
+        if len(scope['top']) < POSITION_CACHE_TOP_SIZE:
+            scope['top'].append((position, nick, pp))
+    return positions
+
+
+def refresh_server_positions(server_id, modes=GAME_MODES, timeout=POSITION_CACHE_TIMEOUT):
+    """Перезаписывает кэш позиций сервера. Вызывается после пересчета лидерборда"""
+    try:
+        positions = load_server_positions(server_id, modes)
+        cache.set_many(
+            {position_cache_key(server_id, mode): scope for mode, scope in positions.items()},
+            timeout,
+        )
+        return positions
+    except Exception as e:
+        logger.error(f"Failed to refresh position cache for server {server_id}: {str(e)}")
+        return None
+
+
+def get_server_positions(server_id, mode):
+    """Позиции сервера в режиме из кэша, при промахе загружаются из БД и кэшируются"""
+    scope = cache.get(position_cache_key(server_id, mode))
+    if scope is None:
+        positions = refresh_server_positions(server_id, [mode], POSITION_CACHE_MISS_TIMEOUT)
+        scope = positions[mode] if positions else {'total': 0, 'positions': {}, 'top': []}
+    return scope
@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+from .models import OsuApiApplication, OSU_RATE_LIMIT, OSU_ERROR_THRESHOLD, OSU_ERROR_WINDOW_SECONDS
+
+logger = logging.getLogger(__name__)
+
+QUOTA_WINDOW_SECONDS = 60
+QUOTA_PERSIST_INTERVAL = 30
+QUOTA_RELOAD_INTERVAL = 300
+
+
+class _AppQuota:
+    """Состояние квоты одного api приложения: скользящее окно запросов и ошибок"""
+    __slots__ = ('app', 'requests', 'errors')
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = deque()
+        self.errors = deque()
+        for t_str in app.error_times or []:
+            try:
+                self.errors.append(datetime.fromisoformat(t_str).timestamp())
+            except (TypeError, ValueError):
+                pass
+
+    def prune(self, now):
+        while self.requests and now - self.requests[0] >= QUOTA_WINDOW_SECONDS:
+            self.requests.popleft()
+        while self.errors and now - self.errors[0] >= OSU_ERROR_WINDOW_SECONDS:
+            self.errors.popleft()
+
+    @property
+    def is_active(self):
+        return len(self.errors) < OSU_ERROR_THRESHOLD
+
+    @property
+    def headroom(self):
+        if not self.is_active:
+            return 0
+        return OSU_RATE_LIMIT - len(self.requests)
+
+    def seconds_until_available(self, now):
+        if not self.is_active:
+            return self.errors[-OSU_ERROR_THRESHOLD] + OSU_ERROR_WINDOW_SECONDS - now
+        if self.headroom > 0:
+            return 0
+        return self.requests[0] + QUOTA_WINDOW_SECONDS - now
+
+
+class QuotaManager:
+    """
+    Процессный менеджер квот osu! api. Лимиты, circuit breaker по ошибкам и выбор
+    приложения живут в памяти, в OsuApiApplication состояние сбрасывается раз в
+    QUOTA_PERSIST_INTERVAL секунд. Приложения с is_active=False не используются.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quotas = {}
+        self._loaded_at = None
+        self._persisted_at = time.time()
+
+    def _ensure_loaded(self, now):
+        if self._loaded_at is not None and now - self._loaded_at < QUOTA_RELOAD_INTERVAL:
+            return
+        apps = list(OsuApiApplication.objects.filter(is_active=True))
+        quotas = {}
+        for app in apps:
+            existing = self._quotas.get(app.pk)
+            if existing is not None:
+                existing.app = app
+                quotas[app.pk] = existing
+            else:
+                quotas[app.pk] = _AppQuota(app)
+        self._quotas = quotas
+        self._loaded_at = now
+
+    def _quota_for(self, app, now):
+        self._ensure_loaded(now)
+        quota = self._quotas.get(app.pk)
+        if quota is None:
+            self._loaded_at = None
+            self._ensure_loaded(now)
+            quota = self._quotas.get(app.pk)
+        return quota
+
+    def reload(self):
+        """Принудительно перечитывает список приложений из БД"""
+        with self._lock:
+            self._loaded_at = None
+            self._ensure_loaded(time.time())
+
+    def _best(self, now):
+        best = None
+        for quota in self._quotas.values():
+            quota.prune(now)
+            if quota.headroom > 0 and (best is None or quota.headroom > best.headroom):
+                best = quota
+        return best
+
+    def select_app(self):
+        """Возвращает приложение с наибольшим запасом квоты или None, не блокируясь"""
+        with self._lock:
+            now = time.time()
+            self._ensure_loaded(now)
+            best = self._best(now)
+            return best.app if best else None
+
+    def has_headroom(self, app):
+        with self._lock:
+            now = time.time()
+            quota = self._quota_for(app, now)
+            if quota is None:
+                return False
+            quota.prune(now)
+            return quota.headroom > 0
+
+    def acquire(self, app):
+        """Резервирует один запрос в окне приложения. False, если квота исчерпана"""
+        with self._lock:
+            now = time.time()
+            quota = self._quota_for(app, now)
+            if quota is None:
+                return False
+            quota.prune(now)
+            if quota.headroom <= 0:
+                return False
+            quota.requests.append(now)
+        self.maybe_persist()
+        return True
+
+    def acquire_any(self):
+        """Выбирает приложение и сразу резервирует в нем запрос"""
+        with self._lock:
+            now = time.time()
+            self._ensure_loaded(now)
+            best = self._best(now)
+            if best is None:
+                return None
+            best.requests.append(now)
+        self.maybe_persist()
+        return best.app
+
+    def record_error(self, app):
+        """Учитывает ошибку приложения. Возвращает False, если сработал circuit breaker"""
+        with self._lock:
+            now = time.time()
+            quota = self._quota_for(app, now)
+            if quota is None:
+                return False
+            quota.errors.append(now)
+            quota.prune(now)
+            active = quota.is_active
+        if not active:
+            logger.warning(f"API app {app.name} disabled for {OSU_ERROR_WINDOW_SECONDS}s after repeated errors")
+            self.persist()
+        return active
+
+    def seconds_until_available(self):
+        """Сколько секунд ждать до появления свободного запроса. None, если приложений нет"""
+        with self._lock:
+            now = time.time()
+            self._ensure_loaded(now)
+            waits = []
+            for quota in self._quotas.values():
+                quota.prune(now)
+                waits.append(max(0, quota.seconds_until_available(now)))
+            return min(waits) if waits else None
+
+    def wait_for_app(self, timeout=QUOTA_WINDOW_SECONDS):
+        """
+        Ждет свободную квоту не дольше timeout секунд и резервирует в ней запрос.
+        Возвращает приложение с уже занятым слотом или None
+        """
+        deadline = time.time() + timeout
+        while True:
+            app = self.acquire_any()
+            if app is not None:
+                return app
+            wait = self.seconds_until_available()
+            remaining = deadline - time.time()
+            if wait is None or remaining <= 0:
+                return None
+            time.sleep(min(max(wait, 0.05), remaining))
+
+    def maybe_persist(self):
+        if time.time() - self._persisted_at >= QUOTA_PERSIST_INTERVAL:
+            self.persist()
+
+    def persist(self):
+        """Сохраняет счетчики, ошибки и состояние circuit breaker приложений в БД"""
+        with self._lock:
+            now = time.time()
+            self._persisted_at = now
+            snapshot = []
+            for pk, quota in self._quotas.items():
+                quota.prune(now)
+                error_times = [
+                    datetime.fromtimestamp(t, tz=dt_timezone.utc).isoformat() for t in quota.errors
+                ]
+                snapshot.append((pk, len(quota.requests), error_times, not quota.is_active))
+
+        reset_time = timezone.now()
+        for pk, requests_count, error_times, circuit_open in snapshot:
+            try:
+                OsuApiApplication.objects.filter(pk=pk).update(
+                    requests_count=requests_count,
+                    error_times=error_times,
+                    circuit_open=circuit_open,
+                    reset_time=reset_time,
+                )
+            except Exception as e:
+                logger.error(f"Failed to persist quota state for app {pk}: {str(e)}")
+
+
+quota_manager = QuotaManager()
@@ -0,0 +1,139 @@
+import logging
+import time
+from datetime import timedelta
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import OsuPerformance, LeaderboardRanking, LeaderboardState
+from .osu_api_service import GAME_MODES
+from .response_cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+RANKING_INSERT_BATCH = 2000
+RANKING_REBUILD_INTERVAL = 300
+RANKING_REBUILD_LOCK_TIMEOUT = 15 * 60
+
+# отображаемые ник и аватар хранятся в UnauthorizedOsuUsers, достаточно одного JOIN
+LEADERBOARD_USER_RELATED = ['user']
+
+
+def order_leaderboard(queryset):
+    """Порядок лидерборда: сначала игроки с pp и рангом, затем по pp и глобальному рангу"""
+    return queryset.order_by(
+        '-sort_priority',
+        '-pp',
+        F('global_rank').asc(nulls_last=True),
+        'id'
+    )
+
+
+def scope_key(mode, region='', city=''):
+    return f"{mode}|{region or ''}|{city or ''}"
+
+
+def rebuild_rankings():
+    """
+    Пересчитывает позиции для всех областей (режим, регион, город) в новое поколение
+    и атомарно делает его активным. Предыдущее поколение остается для запросов,
+    начатых до переключения, и удаляется при следующей перестройке.
+    Если перестройка уже идет в другом процессе, возвращает None.
+    """
+    LeaderboardState.get()
+    started_at = timezone.now()
+    # захват через условный UPDATE строки состояния виден всем процессам, в отличие от LocMemCache
+    claimed = LeaderboardState.objects.filter(pk=1).filter(
+        Q(ranking_rebuild_started_at__isnull=True)
+        | Q(ranking_rebuild_started_at__lt=started_at - timedelta(seconds=RANKING_REBUILD_LOCK_TIMEOUT))
+    ).update(ranking_rebuild_started_at=started_at, rankings_dirty=False)
+    if not claimed:
+        logger.info("Rankings rebuild is already running, skipping")
+        return None
+    try:
+        generation = _rebuild_rankings()
+    except Exception:
+        LeaderboardState.mark_rankings_dirty()
+        raise
+    finally:
+        LeaderboardState.objects.filter(pk=1, ranking_rebuild_started_at=started_at).update(
+            ranking_rebuild_started_at=None
+        )
+    bump_data_version()
+    return generation
+
+
+def _rebuild_rankings():
+    """
+    Новое поколение пишется пачками, каждая в своей короткой транзакции, чтобы не держать
+    блокировку записи SQLite на всю перестройку. Читатели его не видят до переключения
+    ranking_generation одним UPDATE в конце.
+    """
+    started = time.monotonic()
+    state = LeaderboardState.get()
+    generation = state.ranking_generation + 1
+
+    # старое поколение и остатки прерванной перестройки
+    stale = LeaderboardRanking.objects.exclude(generation=state.ranking_generation)
+    while True:
+        pks = list(stale.values_list('pk', flat=True)[:RANKING_INSERT_BATCH])
+        if not pks:
+            break
+        LeaderboardRanking.objects.filter(pk__in=pks).delete()
+
+    totals = {}
+    batch = []
+    for mode in GAME_MODES:
+        rows = order_leaderboard(OsuPerformance.objects.filter(mode=mode)).values_list(
+            'id', 'user__region', 'user__cities'
+        )
+        for performance_id, region, city in rows.iterator(chunk_size=RANKING_INSERT_BATCH):
+            scopes = [('', '')]
+            if region:
+                scopes.append((region, ''))
+                if city:
+                    scopes.append((region, city))
+            for scope_region, scope_city in scopes:
+                key = scope_key(mode, scope_region, scope_city)
+                totals[key] = totals.get(key, 0) + 1
+                batch.append(LeaderboardRanking(
+                    generation=generation,
+                    mode=mode,
+                    region=scope_region,
+                    city=scope_city,
+                    position=totals[key],
+                    performance_id=performance_id,
+                ))
+            if len(batch) >= RANKING_INSERT_BATCH:
+                LeaderboardRanking.objects.bulk_create(batch)
+                batch = []
+    if batch:
+        LeaderboardRanking.objects.bulk_create(batch)
+
+    LeaderboardState.objects.filter(pk=state.pk).update(
+        ranking_generation=generation,
+        ranking_totals=totals,
+        ranking_built_at=timezone.now(),
+    )
+
+    logger.info(f"Rebuilt rankings generation {generation} in {time.monotonic() - started:.2f}s")
+    return generation
+
+
+def get_ranking_scope(mode, region=None, city=None):
+    """
+    Возвращает (queryset позиций области, количество игроков) из активного поколения
+    или None, если рейтинг еще не построен.
+    """
+    state = LeaderboardState.get()
+    if not state.ranking_generation:
+        return None
+    region = region or ''
+    city = city if region and city else ''
+    queryset = LeaderboardRanking.objects.filter(
+        generation=state.ranking_generation,
+        mode=mode,
+        region=region,
+        city=city,
+    ).select_related(
+        *[f'performance__{related}' for related in LEADERBOARD_USER_RELATED]
+    ).order_by('position')
+    return queryset, state.ranking_totals.get(scope_key(mode, region, city), 0)
@@ -0,0 +1,343 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from asgiref.sync import sync_to_async
+from django.db.models import Sum, Max, Exists, OuterRef
+from Accounts.models import UnauthorizedOsuUsers, CustomUser
+from .osu_api_service import OsuApiService, OSU_BATCH_SIZE, MAX_WORKERS
+from .async_osu_service import AsyncOsuApiService
+from .quota_manager import quota_manager
+from .ranking_service import rebuild_rankings, RANKING_REBUILD_INTERVAL
+from .leaderboard_service import LeaderboardService
+from .models import StatsFetchQueue, LeaderboardState
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_LINKED = 5 * 60
+REFRESH_INTERVAL_ACTIVE = 10 * 60
+REFRESH_INTERVAL_RECENT = 60 * 60
+REFRESH_INTERVAL_IDLE = 6 * 60 * 60
+REFRESH_INTERVAL_DORMANT = 24 * 60 * 60
+REFRESH_INTERVAL_ZERO_PP = 7 * 24 * 60 * 60
+REFRESH_RETRY_DELAY = 60
+
+ACTIVE_WITHIN = 24 * 60 * 60
+RECENT_WITHIN = 7 * 24 * 60 * 60
+IDLE_WITHIN = 30 * 24 * 60 * 60
+
+SCHEDULER_RELOAD_INTERVAL = 60
+SCHEDULER_IDLE_SLEEP = 5
+SERVER_REFRESH_INTERVAL = 60
+FETCH_QUEUE_POLL_INTERVAL = 10
+FETCH_QUEUE_DRAIN_LIMIT = 1000
+
+
+class _Entry:
+    __slots__ = ('pk', 'osu_id', 'due', 'linked', 'last_changed', 'pp', 'playcount')
+
+    def __init__(self, pk, osu_id, linked, last_changed, pp, playcount):
+        self.pk = pk
+        self.osu_id = osu_id
+        self.linked = linked
+        self.last_changed = last_changed
+        self.pp = pp
+        self.playcount = playcount
+        self.due = 0
+
+    def interval(self, now):
+        """Интервал обновления по привязке аккаунта и давности последних изменений статистики"""
+        if self.linked:
+            return REFRESH_INTERVAL_LINKED
+        if not self.pp:
+            return REFRESH_INTERVAL_ZERO_PP
+        idle = now - self.last_changed
+        if idle < ACTIVE_WITHIN:
+            return REFRESH_INTERVAL_ACTIVE
+        if idle < RECENT_WITHIN:
+            return REFRESH_INTERVAL_RECENT
+        if idle < IDLE_WITHIN:
+            return REFRESH_INTERVAL_IDLE
+        return REFRESH_INTERVAL_DORMANT
+
+
+class RefreshScheduler:
+    """
+    Приоритетная очередь обновления игроков по времени следующего обновления.
+    Привязанные и активные игроки обновляются раз в несколько минут, неактивные
+    и игроки без pp - раз в сутки и реже. Квота расходуется непрерывно, без циклов.
+    """
+
+    def __init__(self, batch_size=OSU_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._heap = []
+        self._entries = {}
+        self._in_flight = set()
+        self._seq = itertools.count()
+        self._max_pk = 0
+        self._loaded_at = None
+        self._changed = set()
+        self._rebuilt_at = 0
+        self._servers_changed = set()
+        self._servers_refreshed_at = 0
+        self._queue_polled_at = 0
+
+    def _push(self, entry, due):
+        entry.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), entry.pk))
+
+    def _load_users(self, queryset, now, initial):
+        # при старте игроки со статистикой размазываются по своему интервалу,
+        # чтобы не обновлять всех сразу; новые игроки без статистики идут первыми
+
+        linked = CustomUser.objects.filter(osu_user__osu=OuterRef('pk'))
+        rows = queryset.annotate(
+            total_pp=Sum('osu_performances__pp'),
+            total_playcount=Sum('osu_performances__playcount'),
+            stats_changed=Max('osu_performances__last_updated'),
+            is_linked=Exists(linked),
+        ).values_list('pk', 'osu_id', 'stats_changed', 'total_pp', 'total_playcount', 'is_linked')
+
+        added = 0
+        for pk, osu_id, stats_changed, total_pp, total_playcount, is_linked in rows:
+            self._max_pk = max(self._max_pk, pk)
+            if pk in self._entries:
+                continue
+            last_changed = stats_changed.timestamp() if stats_changed else 0
+            entry = _Entry(pk, osu_id, is_linked, last_changed, total_pp or 0, total_playcount or 0)
+            self._entries[pk] = entry
+            if initial and total_pp is not None:
+                self._push(entry, now + random.uniform(0, entry.interval(now)))
+            else:
+                self._push(entry, now)
+            added += 1
+        return added
+
+    def _refresh_linked(self, now):
+        linked_pks = set(CustomUser.objects.filter(
+            osu_user__isnull=False
+        ).values_list('osu_user__osu', flat=True))
+        for pk, entry in self._entries.items():
+            is_linked = pk in linked_pks
+            newly_linked = is_linked and not entry.linked
+            entry.linked = is_linked
+            if newly_linked and pk not in self._in_flight and entry.due > now + REFRESH_INTERVAL_LINKED:
+                self._push(entry, now)
+
+    def maybe_reload(self):
+        """Подхватывает новых игроков и изменения привязки аккаунтов"""
+        now = time.time()
+        if self._loaded_at is not None and now - self._loaded_at < SCHEDULER_RELOAD_INTERVAL:
+            return
+        initial = self._loaded_at is None
+        added = self._load_users(UnauthorizedOsuUsers.objects.filter(pk__gt=self._max_pk), now, initial)
+        if not initial:
+            self._refresh_linked(now)
+        self._loaded_at = now
+        if added:
+            logger.info(f"Scheduler picked up {added} users, tracking {len(self._entries)}")
+
+    def drain_fetch_queue(self):
+        """Переносит новых игроков из StatsFetchQueue в начало очереди, раньше просроченных"""
+        now = time.time()
+        if now - self._queue_polled_at < FETCH_QUEUE_POLL_INTERVAL:
+            return
+        self._queue_polled_at = now
+        queued = list(StatsFetchQueue.objects.order_by('created_at').values_list(
+            'pk', 'user_id', 'user__osu_id'
+        )[:FETCH_QUEUE_DRAIN_LIMIT])
+        if not queued:
+            return
+
+        for _, pk, osu_id in queued:
+            entry = self._entries.get(pk)
+            if entry is None:
+                entry = _Entry(pk, osu_id, False, 0, 0, 0)
+                self._entries[pk] = entry
+            if pk not in self._in_flight:
+                self._push(entry, 0)
+        StatsFetchQueue.objects.filter(pk__in=[queue_pk for queue_pk, _, _ in queued]).delete()
+        logger.info(f"Scheduler fast-tracked {len(queued)} new users")
+
+    def _pop(self):
+        while self._heap:
+            due, _, pk = heapq.heappop(self._heap)
+            entry = self._entries.get(pk)
+            if entry is None or entry.due != due or pk in self._in_flight:
+                continue
+            return entry
+        return None
+
+    def seconds_until_due(self):
+        while self._heap:
+            due, _, pk = self._heap[0]
+            entry = self._entries.get(pk)
+            if entry is None or entry.due != due or pk in self._in_flight:
+                heapq.heappop(self._heap)
+                continue
+            return max(0, due - time.time())
+        return SCHEDULER_IDLE_SLEEP
+
+    def next_batch(self):
+        """
+        Возвращает пачку игроков, которым пора обновиться. Неполная пачка добивается
+        ближайшими по очереди игроками - запрос стоит столько же.
+        """
+        if self.seconds_until_due() > 0:
+            return []
+        batch = []
+        while len(batch) < self.batch_size:
+            entry = self._pop()
+            if entry is None:
+                break
+            batch.append(entry)
+            self._in_flight.add(entry.pk)
+        return batch
+
+    def reschedule(self, batch, results, changed=()):
+        """Планирует следующее обновление по результату загрузки пачки"""
+        now = time.time()
+        self._changed.update(changed)
+        self._servers_changed.update(changed)
+        for entry in batch:
+            self._in_flight.discard(entry.pk)
+            if results is None:
+                self._push(entry, now + REFRESH_RETRY_DELAY)
+                continue
+
+            performances = results.get(entry.osu_id)
+            if performances is None:
+                self._push(entry, now + REFRESH_INTERVAL_DORMANT)
+                continue
+
+            pp = sum(p.pp or 0 for p in performances.values())
+            playcount = sum(p.playcount or 0 for p in performances.values())
+            if pp != entry.pp or playcount != entry.playcount:
+                entry.last_changed = now
+            entry.pp = pp
+            entry.playcount = playcount
+            self._push(entry, now + entry.interval(now))
+
+    def maybe_rebuild(self):
+        """
+        Перестраивает предрассчитанный рейтинг, если с прошлой перестройки были изменения
+        в этом процессе или другой процесс пометил рейтинг устаревшим
+        """
+        if time.time() - self._rebuilt_at < RANKING_REBUILD_INTERVAL:
+            return
+        if not self._changed and not LeaderboardState.get().rankings_dirty:
+            self._rebuilt_at = time.time()
+            return
+        changed, self._changed = self._changed, set()
+        try:
+            rebuild_rankings()
+        except Exception as e:
+            logger.error(f"Error rebuilding rankings: {str(e)}")
+            self._changed |= changed
+        self._rebuilt_at = time.time()
+
+    def maybe_refresh_servers(self):
+        """Ставит в очередь пересчет лидербордов серверов, где состоят изменившиеся игроки"""
+        if not self._servers_changed or time.time() - self._servers_refreshed_at < SERVER_REFRESH_INTERVAL:
+            return
+        changed, self._servers_changed = self._servers_changed, set()
+        LeaderboardService.schedule_refresh_for_players(changed)
+        self._servers_refreshed_at = time.time()
+
+    @staticmethod
+    def _requeue_unfetched(users):
+        # drain_fetch_queue уже удалил строки очереди: новые игроки из незагруженной пачки
+        # возвращаются в StatsFetchQueue и снова попадут в начало очереди
+        StatsFetchQueue.enqueue_unfetched(user.osu_id for user in users)
+
+    @classmethod
+    def _fetch(cls, batch):
+        users = list(UnauthorizedOsuUsers.objects.filter(pk__in=[entry.pk for entry in batch]))
+        app = quota_manager.wait_for_app()
+        users_data = OsuApiService.get_users_data([user.osu_id for user in users], app, reserved=True) if app else None
+        changed = set()
+        results = None
+        if users_data is not None:
+            results = OsuApiService.apply_users_data(users, users_data, changed)
+        if results is None:
+            cls._requeue_unfetched(users)
+        return results, changed
+
+    def run_threads(self, max_workers=MAX_WORKERS):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+            while True:
+                self.maybe_reload()
+                self.drain_fetch_queue()
+                while len(in_flight) < max_workers:
+                    batch = self.next_batch()
+                    if not batch:
+                        break
+                    in_flight[executor.submit(self._fetch, batch)] = batch
+
+                self.maybe_rebuild()
+                self.maybe_refresh_servers()
+                if not in_flight:
+                    time.sleep(min(self.seconds_until_due(), SCHEDULER_IDLE_SLEEP))
+                    continue
+
+                done, _ = wait(in_flight, timeout=SCHEDULER_IDLE_SLEEP, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    try:
+                        results, changed = future.result()
+                    except Exception as e:
+                        logger.error(f"Error updating batch of {len(batch)} users: {str(e)}")
+                        results, changed = None, ()
+                    self.reschedule(batch, results, changed)
+
+    async def _run_async(self, max_in_flight=None):
+        engine = AsyncOsuApiService(max_in_flight)
+        window = max_in_flight or await sync_to_async(engine.quota_window)()
+        async with engine.client_session(window) as session:
+            async def fetch(batch):
+                users = await sync_to_async(list)(
+                    UnauthorizedOsuUsers.objects.filter(pk__in=[entry.pk for entry in batch])
+                )
+                users_data = await engine.fetch_users(session, [user.osu_id for user in users])
+                changed = set()
+                results = None
+                if users_data is not None:
+                    results = await sync_to_async(OsuApiService.apply_users_data)(users, users_data, changed)
+                if results is None:
+                    await sync_to_async(self._requeue_unfetched)(users)
+                return results, changed
+
+            in_flight = {}
+            while True:
+                await sync_to_async(self.maybe_reload)()
+                await sync_to_async(self.drain_fetch_queue)()
+                while len(in_flight) < window:
+                    batch = self.next_batch()
+                    if not batch:
+                        break
+                    in_flight[asyncio.create_task(fetch(batch))] = batch
+
+                await sync_to_async(self.maybe_rebuild)()
+                await sync_to_async(self.maybe_refresh_servers)()
+                if not in_flight:
+                    await asyncio.sleep(min(self.seconds_until_due(), SCHEDULER_IDLE_SLEEP))
+                    continue
+
+                done, _ = await asyncio.wait(
+                    in_flight, timeout=SCHEDULER_IDLE_SLEEP, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    batch = in_flight.pop(task)
+                    try:
+                        results, changed = task.result()
+                    except Exception as e:
+                        logger.error(f"Error updating batch of {len(batch)} users: {str(e)}")
+                        results, changed = None, ()
+                    self.reschedule(batch, results, changed)
+
+    def run_async(self, max_in_flight=None):
+        asyncio.run(self._run_async(max_in_flight))
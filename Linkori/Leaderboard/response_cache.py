@@ -0,0 +1,98 @@
+import functools
+import hashlib
+import logging
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .models import LeaderboardState
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION_CACHE_KEY = 'leaderboard:data_version'
+DATA_VERSION_TTL = 10
+RESPONSE_CACHE_TIMEOUT = 10 * 60
+LEADERBOARD_MAX_AGE = 30
+
+
+def get_data_version():
+    """Текущая версия данных лидерборда. Кэшируется на DATA_VERSION_TTL секунд"""
+    version = cache.get(DATA_VERSION_CACHE_KEY)
+    if version is None:
+        version = LeaderboardState.get().data_version
+        cache.set(DATA_VERSION_CACHE_KEY, version, DATA_VERSION_TTL)
+    return version
+
+
+def bump_data_version():
+    """Инвалидирует закэшированные ответы: вызывается один раз после перестройки рейтинга"""
+    try:
+        updated = LeaderboardState.objects.filter(pk=1).update(data_version=F('data_version') + 1)
+        if not updated:
+            LeaderboardState.get()
+        cache.delete(DATA_VERSION_CACHE_KEY)
+    except Exception as e:
+        logger.error(f"Failed to bump leaderboard data version: {str(e)}")
+
+
+def _digest(name, version, request):
+    query = '&'.join(f'{key}={value}' for key, value in sorted(request.GET.items()))
+    key = f'{name}|{version}|{request.get_host()}|{query}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _if_none_match(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return header.strip() == '*' or etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+def _set_cache_headers(response, etag, cache_control):
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    if cache_control.startswith('private'):
+        response['Vary'] = 'Authorization'
+    return response
+
+
+def cached_leaderboard_response(max_age=LEADERBOARD_MAX_AGE, private=False, versioned=True, skip_params=()):
+    """
+    Кэширует успешные ответы view по параметрам запроса и версии данных лидерборда.
+    Отвечает 304 на If-None-Match и выставляет ETag/Cache-Control для обратного прокси.
+    Ставится под @api_view, чтобы аутентификация и права проверялись и для ответов из кэша.
+    Запросы с параметрами из skip_params не кэшируются.
+    """
+    cache_control = f"{'private' if private else 'public'}, max-age={max_age}"
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if any(param in request.GET for param in skip_params):
+                return view(request, *args, **kwargs)
+
+            version = get_data_version() if versioned else 0
+            digest = _digest(view.__name__, version, request)
+            etag = f'"{digest}"'
+            if _if_none_match(request, etag):
+                return _set_cache_headers(HttpResponseNotModified(), etag, cache_control)
+
+            cache_key = f'leaderboard:response:{digest}'
+            cached = cache.get(cache_key)
+            if cached is not None:
+                content_type, content = cached
+                return _set_cache_headers(HttpResponse(content, content_type=content_type), etag, cache_control)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+            if isinstance(response, Response):
+                content, content_type = JSONRenderer().render(response.data), 'application/json'
+            else:
+                content, content_type = response.content, response['Content-Type']
+            cache.set(cache_key, (content_type, content), RESPONSE_CACHE_TIMEOUT)
+            return _set_cache_headers(response, etag, cache_control)
+
+        return wrapper
+
+    return decorator
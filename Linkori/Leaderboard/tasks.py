@@ -1,6 +1,12 @@
-from celery import shared_task
+from celery import shared_task, group, chord
+from django.conf import settings
 from .extension_service import parse_extension
 from .googlesheet_service import parse_players
+from .leaderboard_service import LeaderboardService, SERVER_REFRESH_REPORT_SLOWEST
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 @shared_task()
 def parse_browser_extension():
@@ -26,4 +32,65 @@ def parse_google_sheet():
         return {
             "status": "error",
             "message": "Failed to parse users from table, check logs for more info"
-        }
\ No newline at end of file
+        }
+
+@shared_task
+def refresh_server_leaderboard(server_id):
+    results = LeaderboardService.refresh_server(server_id)
+    if results and all(results.values()):
+        return {
+            "status": "success",
+            "message": f"Refreshed leaderboard for server {server_id}"
+        }
+    return {
+        "status": "error",
+        "message": f"Failed to refresh leaderboard for server {server_id}, check logs for more info"
+    }
+
+
+@shared_task
+def refresh_server_leaderboards_shard(server_ids):
+    """Пересчитывает часть серверов и возвращает время пересчета каждого"""
+    timings = LeaderboardService.refresh_servers(server_ids)
+    slowest = sorted(timings, key=lambda t: t[1], reverse=True)[:SERVER_REFRESH_REPORT_SLOWEST]
+    logger.info(f"Refreshed {len(timings)} server leaderboards, slowest: {slowest}")
+    return timings
+
+
+@shared_task
+def report_server_leaderboards_refresh(shard_timings):
+    timings = [timing for shard in shard_timings for timing in shard]
+    failed = [server_id for server_id, _, success in timings if not success]
+    slowest = sorted(timings, key=lambda t: t[1], reverse=True)[:SERVER_REFRESH_REPORT_SLOWEST]
+    total = sum(seconds for _, seconds, _ in timings)
+    logger.info(
+        f"Refreshed {len(timings)} server leaderboards in {total:.2f}s of work, "
+        f"{len(failed)} failed, slowest: {slowest}"
+    )
+    return {
+        "status": "success" if not failed else "error",
+        "refreshed": len(timings) - len(failed),
+        "failed": failed,
+        "slowest": slowest,
+    }
+
+
+@shared_task
+def refresh_all_server_leaderboards():
+    """
+    Раскладывает все серверы на ограниченное число частей и пересчитывает их параллельно
+    на воркерах. С result backend итоговые тайминги собирает report_server_leaderboards_refresh.
+    """
+    shards = LeaderboardService.shard_servers()
+    if not shards:
+        return {"status": "success", "message": "No servers to refresh"}
+
+    tasks = group(refresh_server_leaderboards_shard.s(shard) for shard in shards)
+    if getattr(settings, 'CELERY_RESULT_BACKEND', None):
+        chord(tasks)(report_server_leaderboards_refresh.s())
+    else:
+        tasks.apply_async()
+    return {
+        "status": "success",
+        "message": f"Scheduled {sum(len(shard) for shard in shards)} servers in {len(shards)} shards"
+    }
@@ -1,3 +1,689 @@
-from django.test import TestCase
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from Accounts.models import UnauthorizedOsuUsers, OsuUsers, DiscordUsers, CustomUser
+from .models import OsuApiApplication, OsuPerformance, LeaderboardRanking, ServerMember, ServerLeaderboard, ExtensionCrawlCheckpoint, StatsFetchQueue, LeaderboardState, OSU_RATE_LIMIT, OSU_ERROR_THRESHOLD
+from .leaderboard_service import LeaderboardService
+from .extension_service import get_all_players_from_region, parse_extension, load_checkpoints, CHECKPOINT_MAX_AGE
+from .googlesheet_service import parse_players, SHEET_URL
+from .tasks import refresh_server_leaderboard, refresh_server_leaderboards_shard
+from DiscordBot.models import DiscordServer
+from .osu_api_service import OsuApiService
+from .async_osu_service import AsyncOsuApiService
+from .quota_manager import QuotaManager, quota_manager
+from .ranking_service import rebuild_rankings, get_ranking_scope, RANKING_REBUILD_LOCK_TIMEOUT
+from .refresh_scheduler import RefreshScheduler, REFRESH_INTERVAL_ACTIVE, REFRESH_INTERVAL_DORMANT
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync
+from unittest import mock
+import responses
+import time
 
-# Create your tests here.
+
+def make_ruleset(pp, rank, playcount=100):
+    return {
+        'pp': pp,
+        'global_rank': rank,
+        'country_rank': rank,
+        'hit_accuracy': 98.5,
+        'play_count': playcount,
+        'level': {'current': 100},
+    }
+
+
+def make_user_payload(osu_id, username, pp=1000.0, rank=5000):
+    return {
+        'id': int(osu_id),
+        'username': username,
+        'avatar_url': f'https://a.ppy.sh/{osu_id}?1.jpeg',
+        'statistics_rulesets': {
+            'osu': make_ruleset(pp, rank),
+            'taiko': make_ruleset(0, None, 0),
+            'fruits': make_ruleset(pp / 2, rank * 2),
+            'mania': make_ruleset(0, None, 0),
+        },
+    }
+
+
+class OsuApiServiceBatchTests(TestCase):
+    def setUp(self):
+        self.app = OsuApiApplication.objects.create(
+            name='test_app',
+            client_id='1',
+            client_secret='secret',
+            access_token='app_token',
+            token_expires_at=timezone.now() + timedelta(hours=1),
+        )
+        quota_manager.reload()
+        self.user1 = UnauthorizedOsuUsers.objects.create(osu_id='111', nick='old1')
+        self.user2 = UnauthorizedOsuUsers.objects.create(osu_id='222', nick='old2')
+
+    @responses.activate
+    def test_batch_updates_all_modes_with_single_request(self):
+        responses.add(
+            responses.GET, 'https://osu.ppy.sh/api/v2/users',
+            json={'users': [make_user_payload('111', 'player1'), make_user_payload('222', 'player2', pp=500.0)]},
+            status=200
+        )
+
+        results = OsuApiService.update_users_batch([self.user1, self.user2], self.app)
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertIn('ids%5B%5D=111', responses.calls[0].request.url)
+        self.assertEqual(set(results), {'111', '222'})
+        self.assertEqual(OsuPerformance.objects.filter(user=self.user1).count(), 4)
+        self.assertEqual(OsuPerformance.objects.get(user=self.user2, mode='osu').pp, 500.0)
+        self.assertEqual(OsuPerformance.objects.get(user=self.user1, mode='fruits').global_rank, 10000)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.nick, 'player1')
+
+    @responses.activate
+    def test_batch_skips_users_missing_from_response(self):
+        responses.add(
+            responses.GET, 'https://osu.ppy.sh/api/v2/users',
+            json={'users': [make_user_payload('111', 'player1')]},
+            status=200
+        )
+
+        results = OsuApiService.update_users_batch([self.user1, self.user2], self.app)
+
+        self.assertEqual(set(results), {'111'})
+        self.assertFalse(OsuPerformance.objects.filter(user=self.user2).exists())
+
+    @responses.activate
+    def test_batch_skips_unchanged_rows(self):
+        responses.add(
+            responses.GET, 'https://osu.ppy.sh/api/v2/users',
+            json={'users': [make_user_payload('111', 'player1')]},
+            status=200
+        )
+        OsuApiService.update_users_batch([self.user1], self.app)
+        stale = timezone.now() - timedelta(days=1)
+        OsuPerformance.objects.filter(user=self.user1).update(last_updated=stale)
+        UnauthorizedOsuUsers.objects.filter(pk=self.user1.pk).update(last_updated=stale)
+
+        responses.replace(
+            responses.GET, 'https://osu.ppy.sh/api/v2/users',
+            json={'users': [make_user_payload('111', 'player1', pp=1001.5)]},
+            status=200
+        )
+        user = UnauthorizedOsuUsers.objects.get(pk=self.user1.pk)
+        version = LeaderboardState.get().data_version
+        with self.assertNumQueries(4):
+            OsuApiService.update_users_batch([user], self.app)
+        # версия кэша ответов меняется только при перестройке рейтинга
+        self.assertEqual(LeaderboardState.get().data_version, version)
+
+        user.refresh_from_db()
+        self.assertEqual(user.last_updated, stale)
+        self.assertEqual(OsuPerformance.objects.get(user=user, mode='osu').pp, 1001.5)
+        self.assertGreater(OsuPerformance.objects.get(user=user, mode='osu').last_updated, stale)
+        self.assertEqual(OsuPerformance.objects.get(user=user, mode='taiko').last_updated, stale)
+
+    @responses.activate
+    def test_ids_list_import_creates_in_bulk_and_reports_per_id(self):
+        responses.add(
+            responses.GET, 'https://osu.ppy.sh/api/v2/users',
+            json={'users': [make_user_payload('111', 'player1'), make_user_payload('333', 'player3', pp=700.0)]},
+            status=200
+        )
+
+        report = OsuApiService.update_from_osu_ids_list(
+            ['111', 333, '444', '333', 'abc'], modes=['osu', 'fruits'], max_workers=1
+        )
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(report['111'], {'created': False, 'status': 'updated', 'pp': {'osu': 1000.0, 'fruits': 500.0}})
+        self.assertEqual(report['333']['created'], True)
+        self.assertEqual(report['333']['pp']['osu'], 700.0)
+        self.assertEqual(report['444'], {'created': True, 'status': 'not_found', 'pp': {}})
+        self.assertEqual(report['abc']['status'], 'invalid')
+        self.assertEqual(UnauthorizedOsuUsers.objects.get(osu_id='333').nick, 'player3')
+        self.assertTrue(UnauthorizedOsuUsers.objects.filter(osu_id='444').exists())
+        self.assertFalse(StatsFetchQueue.objects.exists())
+
+    @responses.activate
+    def test_ids_list_import_requeues_batch_that_failed_to_save(self):
+        responses.add(
+            responses.GET, 'https://osu.ppy.sh/api/v2/users',
+            json={'users': [make_user_payload('555', 'player5')]},
+            status=200
+        )
+
+        with mock.patch.object(OsuPerformance.objects, 'bulk_create', side_effect=Exception('db down')):
+            report = OsuApiService.update_from_osu_ids_list(['555'], max_workers=1)
+
+        self.assertEqual(report['555']['status'], 'failed')
+        self.assertTrue(StatsFetchQueue.objects.filter(user__osu_id='555').exists())
+
+
+class QuotaManagerTests(TestCase):
+    def setUp(self):
+        self.app1 = OsuApiApplication.objects.create(name='app1', client_id='1', client_secret='s1')
+        self.app2 = OsuApiApplication.objects.create(name='app2', client_id='2', client_secret='s2')
+        self.manager = QuotaManager()
+
+    def test_selects_app_with_most_headroom(self):
+        app = self.manager.acquire_any()
+        self.assertIsNotNone(app)
+        other = self.manager.select_app()
+        self.assertNotEqual(app.pk, other.pk)
+
+    def test_exhausted_quota_returns_none_without_sleeping(self):
+        for _ in range(OSU_RATE_LIMIT * 2):
+            self.assertIsNotNone(self.manager.acquire_any())
+        self.assertIsNone(self.manager.acquire_any())
+        self.assertIsNone(self.manager.select_app())
+        self.assertGreater(self.manager.seconds_until_available(), 0)
+
+    def test_circuit_breaker_disables_app_and_persists(self):
+        for _ in range(OSU_ERROR_THRESHOLD):
+            active = self.manager.record_error(self.app1)
+        self.assertFalse(active)
+        self.assertEqual(self.manager.select_app().pk, self.app2.pk)
+        self.app1.refresh_from_db()
+        self.assertTrue(self.app1.circuit_open)
+        self.assertTrue(self.app1.is_active)
+
+    def test_disabled_app_is_not_used_and_stays_disabled(self):
+        OsuApiApplication.objects.filter(pk=self.app2.pk).update(is_active=False)
+        for _ in range(OSU_RATE_LIMIT):
+            self.assertEqual(self.manager.acquire_any().pk, self.app1.pk)
+        self.assertIsNone(self.manager.select_app())
+
+        self.manager.persist()
+        self.app2.refresh_from_db()
+        self.assertFalse(self.app2.is_active)
+
+    def test_wait_for_app_reserves_request(self):
+        for _ in range(OSU_RATE_LIMIT * 2 - 1):
+            self.manager.acquire_any()
+
+        self.assertIsNotNone(self.manager.wait_for_app(timeout=0))
+        self.assertIsNone(self.manager.wait_for_app(timeout=0))
+
+
+class RefreshSchedulerTests(TestCase):
+    def setUp(self):
+        self.new_user = UnauthorizedOsuUsers.objects.create(osu_id='333')
+        self.dormant = UnauthorizedOsuUsers.objects.create(osu_id='444')
+        OsuPerformance.objects.create(user=self.dormant, mode='osu', pp=100, playcount=10)
+        OsuPerformance.objects.filter(user=self.dormant).update(
+            last_updated=timezone.now() - timedelta(days=365)
+        )
+
+    def test_new_users_are_due_immediately(self):
+        scheduler = RefreshScheduler(batch_size=1)
+        scheduler.maybe_reload()
+        batch = scheduler.next_batch()
+        self.assertEqual([entry.osu_id for entry in batch], ['333'])
+
+    def test_queued_users_are_fetched_first(self):
+        scheduler = RefreshScheduler(batch_size=1)
+        scheduler.maybe_reload()
+        fresh = UnauthorizedOsuUsers.objects.create(osu_id='555')
+        StatsFetchQueue.objects.create(user=fresh)
+
+        scheduler.drain_fetch_queue()
+        self.assertEqual([entry.osu_id for entry in scheduler.next_batch()], ['555'])
+        self.assertEqual([entry.osu_id for entry in scheduler.next_batch()], ['333'])
+        self.assertFalse(StatsFetchQueue.objects.exists())
+
+    @mock.patch('Leaderboard.refresh_scheduler.OsuApiService.get_users_data', return_value=None)
+    @mock.patch('Leaderboard.refresh_scheduler.quota_manager.wait_for_app')
+    def test_failed_fetch_returns_queued_users_to_queue(self, wait_for_app, get_users_data):
+        scheduler = RefreshScheduler(batch_size=1)
+        scheduler.maybe_reload()
+        fresh = UnauthorizedOsuUsers.objects.create(osu_id='555')
+        StatsFetchQueue.objects.create(user=fresh)
+        scheduler.drain_fetch_queue()
+        batch = scheduler.next_batch()
+
+        results, _ = scheduler._fetch(batch)
+        scheduler.reschedule(batch, results)
+
+        self.assertIsNone(results)
+        self.assertEqual(list(StatsFetchQueue.objects.values_list('user__osu_id', flat=True)), ['555'])
+
+    def test_intervals_follow_activity(self):
+        scheduler = RefreshScheduler()
+        scheduler.maybe_reload()
+        batch = scheduler.next_batch()
+        self.assertEqual({entry.osu_id for entry in batch}, {'333', '444'})
+
+        active = OsuPerformance(pp=200, playcount=20)
+        unchanged = OsuPerformance(pp=100, playcount=10)
+        scheduler.reschedule(batch, {'333': {'osu': active}, '444': {'osu': unchanged}})
+
+        entries = {entry.osu_id: entry for entry in batch}
+        now = time.time()
+        self.assertAlmostEqual(entries['333'].due - now, REFRESH_INTERVAL_ACTIVE, delta=5)
+        self.assertAlmostEqual(entries['444'].due - now, REFRESH_INTERVAL_DORMANT, delta=5)
+        self.assertEqual(scheduler.next_batch(), [])
+
+
+class AsyncOsuApiServiceTests(TestCase):
+    def setUp(self):
+        self.app = OsuApiApplication.objects.create(name='app', client_id='1', client_secret='secret')
+        quota_manager.reload()
+        self.fresh = UnauthorizedOsuUsers.objects.create(osu_id='333')
+        self.known = UnauthorizedOsuUsers.objects.create(osu_id='444')
+        OsuPerformance.objects.create(user=self.known, mode='osu', pp=100)
+        self.token_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def token(self, request):
+        self.token_requests += 1
+        return web.json_response({'access_token': 'token', 'expires_in': 86400})
+
+    async def users(self, request):
+        ids = request.query.getall('ids[]')
+        if '333' in ids:
+            return web.json_response({}, status=500)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return web.json_response({'users': [make_user_payload(osu_id, f'p{osu_id}') for osu_id in ids]})
+
+    def update_users(self, users, engine=None):
+        """Прогоняет AsyncOsuApiService.update_users против локального aiohttp сервера"""
+        engine = engine or AsyncOsuApiService(max_in_flight=4)
+
+        async def run():
+            app = web.Application()
+            app.router.add_post('/oauth/token', self.token)
+            app.router.add_get('/api/v2/users', self.users)
+            async with TestServer(app) as server:
+                with mock.patch.multiple(
+                    'Leaderboard.async_osu_service',
+                    OSU_TOKEN_URL=str(server.make_url('/oauth/token')),
+                    OSU_USERS_URL=str(server.make_url('/api/v2/users')),
+                    OSU_BATCH_SIZE=1,
+                ):
+                    return await engine.update_users(users)
+
+        # async_to_sync из основного потока: запросы к БД идут в соединении теста
+        return async_to_sync(run)()
+
+    def test_failed_batch_returns_new_users_to_queue(self):
+        self.assertEqual(self.update_users([self.fresh, self.known]), 1)
+
+        self.assertEqual(list(StatsFetchQueue.objects.values_list('user__osu_id', flat=True)), ['333'])
+        self.assertEqual(OsuPerformance.objects.get(user=self.known, mode='osu').pp, 1000.0)
+
+    def test_token_is_fetched_once_and_window_limits_requests(self):
+        users = [UnauthorizedOsuUsers.objects.create(osu_id=str(osu_id)) for osu_id in range(500, 506)]
+
+        self.assertEqual(self.update_users(users, AsyncOsuApiService(max_in_flight=2)), 6)
+
+        self.assertEqual(self.token_requests, 1)
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(OsuPerformance.objects.filter(user__in=users, mode='osu').count(), 6)
+
+    def test_waits_for_quota(self):
+        acquire_any = quota_manager.acquire_any
+        calls = []
+
+        def acquire_after_wait():
+            calls.append(1)
+            return None if len(calls) == 1 else acquire_any()
+
+        with mock.patch.object(quota_manager, 'acquire_any', side_effect=acquire_after_wait), \
+                mock.patch.object(quota_manager, 'seconds_until_available', return_value=0.01):
+            self.assertEqual(self.update_users([self.known]), 1)
+        self.assertEqual(len(calls), 2)
+
+    def test_exhausted_quota_fails_batch(self):
+        with mock.patch.object(quota_manager, 'acquire_any', return_value=None), \
+                mock.patch.object(quota_manager, 'seconds_until_available', return_value=None):
+            self.assertEqual(self.update_users([self.fresh, self.known]), 0)
+
+        self.assertEqual(self.token_requests, 0)
+        self.assertEqual(list(StatsFetchQueue.objects.values_list('user__osu_id', flat=True)), ['333'])
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        players = [
+            ('1', 'SA', 'YAK', 3000, 100),
+            ('2', 'SA', None, 2000, 200),
+            ('3', 'PRI', 'VLA', 2500, 150),
+            ('4', None, None, 0, None),
+            ('5', 'SA', 'YAK', 1000, 900),
+            ('6', 'SA', None, 1000, 900),
+            ('7', None, None, 1000, None),
+        ]
+        for osu_id, region, city, pp, rank in players:
+            user = UnauthorizedOsuUsers.objects.create(osu_id=osu_id, nick=f'p{osu_id}', region=region, cities=city)
+            OsuPerformance.objects.create(user=user, mode='osu', pp=pp, global_rank=rank)
+
+    def positions(self, region=None, city=None):
+        queryset, total = get_ranking_scope('osu', region, city)
+        return [row.performance.user.osu_id for row in queryset], total
+
+    def test_rebuild_assigns_positions_per_scope(self):
+        self.assertIsNone(get_ranking_scope('osu'))
+        rebuild_rankings()
+
+        self.assertEqual(self.positions(), (['1', '3', '2', '5', '6', '7', '4'], 7))
+        self.assertEqual(self.positions('SA'), (['1', '2', '5', '6'], 4))
+        self.assertEqual(self.positions('SA', 'YAK'), (['1', '5'], 2))
+        self.assertEqual(self.positions(None, 'YAK'), (['1', '3', '2', '5', '6', '7', '4'], 7))
+
+    def test_concurrent_rebuild_is_skipped(self):
+        generation = rebuild_rankings()
+        LeaderboardState.objects.filter(pk=1).update(ranking_rebuild_started_at=timezone.now())
+
+        self.assertIsNone(rebuild_rankings())
+        self.assertEqual(LeaderboardState.get().ranking_generation, generation)
+
+        LeaderboardState.objects.filter(pk=1).update(
+            ranking_rebuild_started_at=timezone.now() - timedelta(seconds=RANKING_REBUILD_LOCK_TIMEOUT + 1)
+        )
+        self.assertEqual(rebuild_rankings(), generation + 1)
+        self.assertIsNone(LeaderboardState.get().ranking_rebuild_started_at)
+
+    def test_interrupted_rebuild_keeps_active_generation(self):
+        generation = rebuild_rankings()
+        bulk_create = LeaderboardRanking.objects.bulk_create
+        calls = []
+
+        def fail_second_batch(batch):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise Exception('db locked')
+            return bulk_create(batch)
+
+        with mock.patch('Leaderboard.ranking_service.RANKING_INSERT_BATCH', 2), \
+                mock.patch.object(LeaderboardRanking.objects, 'bulk_create', side_effect=fail_second_batch):
+            with self.assertRaises(Exception):
+                rebuild_rankings()
+
+        # первая пачка записана отдельно, но поколение не переключено
+        self.assertTrue(LeaderboardRanking.objects.filter(generation=generation + 1).exists())
+        self.assertEqual(LeaderboardState.get().ranking_generation, generation)
+        self.assertTrue(LeaderboardState.get().rankings_dirty)
+        self.assertEqual(self.positions('SA'), (['1', '2', '5', '6'], 4))
+
+        self.assertEqual(rebuild_rankings(), generation + 1)
+        self.assertEqual(self.positions('SA'), (['1', '2', '5', '6'], 4))
+        self.assertFalse(LeaderboardRanking.objects.exclude(generation__in=[generation, generation + 1]).exists())
+
+    def test_mainboard_pages_match_live_order(self):
+        live = self.client.get(reverse('mainboard'), {'page_size': 2, 'page': 2}).json()
+        rebuild_rankings()
+        rebuild_rankings()
+        ranked = self.client.get(reverse('mainboard'), {'page_size': 2, 'page': 2}).json()
+
+        self.assertEqual(ranked, live)
+        self.assertEqual(ranked['count'], 7)
+        self.assertEqual([row['user']['osu_id'] for row in ranked['results']], ['2', '5'])
+
+    def test_cursor_pagination_walks_whole_board(self):
+        rebuild_rankings()
+        seen = []
+        response = self.client.get(reverse('mainboard'), {'pagination': 'cursor', 'page_size': 2, 'total': 1}).json()
+        self.assertEqual(response['count'], 7)
+        while True:
+            seen.extend(row['user']['osu_id'] for row in response['results'])
+            if not response['next']:
+                break
+            response = self.client.get(response['next']).json()
+
+        self.assertEqual(seen, ['1', '3', '2', '5', '6', '7', '4'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('mainboard'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('mainboard'), {'page': 999})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_page_query_count_does_not_depend_on_page_size(self):
+        for osu_id in ('1', '2', '5'):
+            osu_user = OsuUsers.objects.create(
+                osu=UnauthorizedOsuUsers.objects.get(osu_id=osu_id),
+                access_token='t', token_expires_at=timezone.now()
+            )
+            discord_user = DiscordUsers.objects.create(
+                discord_id=f'd{osu_id}', nick=f'discord{osu_id}', avatar='a_hash',
+                access_token='t', token_expires_at=timezone.now()
+            )
+            CustomUser.objects.create_user(
+                osu_id=osu_id, osu_user=osu_user, discord_user=discord_user, nick_source='discord_username'
+            )
+
+        def page_queries(params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('mainboard'), params).json()
+            return len(queries), response
+
+        self.client.get(reverse('mainboard'))
+        live = page_queries({'page_size': 7})
+        self.assertEqual(page_queries({'page_size': 1})[0], live[0])
+        rebuild_rankings()
+        ranked = page_queries({'page_size': 7})
+        self.assertEqual(page_queries({'page_size': 1})[0], ranked[0])
+        self.assertEqual(ranked[1], live[1])
+        cursor = page_queries({'pagination': 'cursor', 'page_size': 7})
+        self.assertEqual(page_queries({'pagination': 'cursor', 'page_size': 1})[0], cursor[0])
+
+        response = ranked[1]
+        nicks = {row['user']['osu_id']: row['user']['nick'] for row in response['results']}
+        self.assertEqual(nicks['2'], 'discord2')
+        self.assertEqual(nicks['3'], 'p3')
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = UnauthorizedOsuUsers.objects.create(osu_id='1', nick='p1')
+        OsuPerformance.objects.create(user=user, mode='osu', pp=1000, global_rank=10)
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get(reverse('mainboard'))
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'public, max-age=30')
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('mainboard'))
+            not_modified = self.client.get(reverse('mainboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertNotEqual(self.client.get(reverse('mainboard'), {'page_size': 1})['ETag'], etag)
+
+    def test_data_change_invalidates(self):
+        etag = self.client.get(reverse('mainboard'))['ETag']
+        rebuild_rankings()
+
+        response = self.client.get(reverse('mainboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+def make_linked_member(server, osu_id, stats):
+    """Привязанный участник сервера со статистикой {mode: (pp, global_rank)}"""
+    osu = UnauthorizedOsuUsers.objects.create(osu_id=osu_id, nick=f'p{osu_id}')
+    osu_user = OsuUsers.objects.create(osu=osu, access_token='t', token_expires_at=timezone.now())
+    discord_user = DiscordUsers.objects.create(discord_id=f'd{osu_id}', nick=f'd{osu_id}',
+                                               access_token='t', token_expires_at=timezone.now())
+    user = CustomUser.objects.create_user(osu_id=osu_id, osu_user=osu_user, discord_user=discord_user)
+    ServerMember.objects.create(user=user, server=server)
+    for mode, (pp, rank) in stats.items():
+        OsuPerformance.objects.create(user=osu, mode=mode, pp=pp, global_rank=rank)
+    return user
+
+
+class ServerLeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = DiscordServer.objects.create(server_id='100', server_name='guild')
+        self.leaderboard = ServerLeaderboard.objects.create(server=self.server)
+        self.first = make_linked_member(self.server, '1', {'osu': (3000, 10), 'mania': (100, 500)})
+        self.second = make_linked_member(self.server, '2', {'osu': (4000, 5), 'mania': (200, 300)})
+        self.unlinked = CustomUser.objects.create_user(discord_id='3')
+        ServerMember.objects.create(user=self.unlinked, server=self.server)
+        other = DiscordServer.objects.create(server_id='200', server_name='other')
+        make_linked_member(other, '4', {'osu': (9000, 1)})
+
+    def test_rebuild_all_modes_with_constant_queries(self):
+        with self.assertNumQueries(6):
+            results = LeaderboardService.update_server_leaderboard_all_modes(self.leaderboard)
+        self.assertTrue(all(results.values()))
+
+        top = LeaderboardService.get_top_players('100', mode='osu')
+        self.assertEqual([(entry.user, entry.position) for entry in top], [(self.second, 1), (self.first, 2)])
+        self.assertEqual(LeaderboardService.get_user_position(self.first, '100', mode='mania'), 2)
+        self.assertEqual(self.leaderboard.entries.filter(mode='taiko').count(), 0)
+
+    def test_refresh_writes_only_changed_entries(self):
+        LeaderboardService.update_server_leaderboard_all_modes(self.leaderboard)
+        ids = dict(self.leaderboard.entries.values_list('user_id', 'id').filter(mode='osu'))
+
+        OsuPerformance.objects.filter(user__osu_id='1', mode='osu').update(pp=5000)
+        OsuPerformance.objects.filter(user__osu_id='2', mode='mania').delete()
+        with CaptureQueriesContext(connection) as queries:
+            LeaderboardService.update_server_leaderboard_all_modes(self.leaderboard)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('INSERT')])
+
+        osu = {entry.user_id: entry for entry in self.leaderboard.entries.filter(mode='osu')}
+        self.assertEqual({user_id: entry.id for user_id, entry in osu.items()}, ids)
+        self.assertEqual((osu[self.first.pk].position, osu[self.first.pk].previous_position), (1, 2))
+        self.assertEqual((osu[self.second.pk].position, osu[self.second.pk].previous_position), (2, 1))
+        mania = self.leaderboard.entries.get(mode='mania')
+        self.assertEqual((mania.user, mania.position, mania.previous_position), (self.first, 1, 2))
+
+    @mock.patch('Leaderboard.tasks.refresh_server_leaderboard.delay')
+    def test_reads_schedule_refresh_in_background(self, delay):
+        leaderboard = LeaderboardService.get_server_leaderboard('100', refresh=True)
+        # отметка о задаче в очереди хранится в БД, а не в кэше процесса
+        cache.clear()
+        LeaderboardService.get_server_leaderboard('100', refresh=True)
+
+        delay.assert_called_once_with('100')
+        self.assertEqual(leaderboard.entries.count(), 0)
+
+        refresh_server_leaderboard('100')
+        LeaderboardService.get_server_leaderboard('100', refresh=True)
+        self.assertEqual(delay.call_count, 2)
+
+    @mock.patch('Leaderboard.tasks.refresh_server_leaderboard.delay')
+    def test_changed_players_refresh_only_their_servers(self, delay):
+        changed = {self.first.osu_user.osu_id, UnauthorizedOsuUsers.objects.create(osu_id='5').pk}
+        self.assertEqual(LeaderboardService.schedule_refresh_for_players(changed), 1)
+        delay.assert_called_once_with('100')
+
+        self.assertEqual(refresh_server_leaderboard('100')['status'], 'success')
+        self.assertEqual(self.leaderboard.entries.filter(mode='osu').count(), 2)
+
+    def test_shards_are_bounded_and_report_timings(self):
+        for i in range(5):
+            DiscordServer.objects.create(server_id=f'x{i}', server_name=f'x{i}', member_count=i)
+        shards = LeaderboardService.shard_servers(chunk_size=2, max_shards=3)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted(sum(shards, [])), sorted(DiscordServer.objects.values_list('server_id', flat=True)))
+
+        timings = refresh_server_leaderboards_shard(['100', 'missing'])
+        self.assertEqual([(server_id, success) for server_id, _, success in timings],
+                         [('100', True), ('missing', False)])
+
+
+class ExtensionIngestTests(TestCase):
+    @responses.activate
+    def test_pages_are_inserted_in_bulk(self):
+        UnauthorizedOsuUsers.objects.create(osu_id='1', nick='existing', region='PRI')
+        url = 'https://osuworld.octo.moe/api/RU/RU-SA/top/osu'
+        responses.add(responses.GET, url, json={'top': [{'id': 1}, {'id': 2}, {'id': 3}]})
+        responses.add(responses.GET, url, json={'top': [{'id': 3}, {'id': 4}]})
+        responses.add(responses.GET, url, json={'top': []})
+
+        seen_ids = set()
+        with self.assertNumQueries(6):
+            players = get_all_players_from_region('SA', 'osu', seen_ids)
+
+        self.assertEqual(players, 4)
+        self.assertEqual(seen_ids, {'1', '2', '3', '4'})
+        self.assertEqual(UnauthorizedOsuUsers.objects.get(osu_id='1').region, 'PRI')
+        self.assertEqual(UnauthorizedOsuUsers.objects.filter(region='SA').count(), 3)
+        self.assertEqual(StatsFetchQueue.objects.count(), 4)
+
+    @responses.activate
+    @mock.patch('Leaderboard.extension_service.HostRateLimiter.wait')
+    def test_interrupted_crawl_resumes_from_checkpoint(self, wait):
+        url = 'https://osuworld.octo.moe/api/RU/RU-SA/top/osu'
+        responses.add(responses.GET, url, json={'top': [{'id': 1}]})
+        responses.add(responses.GET, url, status=404)
+        responses.add(responses.GET, 'https://osuworld.octo.moe/api/RU/RU-SA/top/mania', json={'top': []})
+
+        self.assertFalse(parse_extension(regions=['SA'], modes=['osu', 'mania'], max_streams=1))
+        checkpoint = ExtensionCrawlCheckpoint.objects.get(region='SA', mode='osu')
+        self.assertEqual((checkpoint.next_page, checkpoint.completed), (2, False))
+        self.assertTrue(ExtensionCrawlCheckpoint.objects.get(region='SA', mode='mania').completed)
+
+        responses.reset()
+        responses.add(responses.GET, url, json={'top': [{'id': 2}]})
+        responses.add(responses.GET, url, json={'top': []})
+        self.assertTrue(parse_extension(regions=['SA'], modes=['osu', 'mania'], max_streams=1))
+
+        self.assertEqual([call.request.url for call in responses.calls], [f'{url}?page=2', f'{url}?page=3'])
+        self.assertEqual(set(UnauthorizedOsuUsers.objects.values_list('osu_id', flat=True)), {'1', '2'})
+        self.assertEqual(ExtensionCrawlCheckpoint.objects.get(region='SA', mode='osu').players, 2)
+
+    def test_stuck_stream_does_not_block_new_crawl(self):
+        ExtensionCrawlCheckpoint.objects.create(region='SA', mode='osu', next_page=5)
+        ExtensionCrawlCheckpoint.objects.create(region='SA', mode='mania', completed=True)
+        ExtensionCrawlCheckpoint.objects.filter(region='SA', mode='osu').update(
+            updated_at=timezone.now() - CHECKPOINT_MAX_AGE - timedelta(hours=1)
+        )
+
+        checkpoints = load_checkpoints(['SA'], ['osu', 'mania'])
+
+        self.assertEqual({(c.mode, c.next_page, c.completed) for c in checkpoints}, {('osu', 1, False), ('mania', 1, False)})
+
+
+def sheet_row(osu_id, region, city=''):
+    return f'https://osu.ppy.sh/users/{osu_id},,nick{osu_id},x,x,,,{city},{region}'
+
+
+class GoogleSheetImportTests(TestCase):
+    url = SHEET_URL.split('#')[0]
+
+    @responses.activate
+    def test_import_upserts_changed_rows_and_skips_unchanged_sheet(self):
+        UnauthorizedOsuUsers.objects.create(osu_id='1', nick='existing', region='PRI')
+        rows = [sheet_row(1, 'Республика Саха', 'Якутск'), sheet_row(2, 'ЕАО'), 'header,only', sheet_row(3, 'Unknown')]
+        responses.add(responses.GET, self.url, body='\n'.join(rows))
+
+        self.assertTrue(parse_players())
+        existing = UnauthorizedOsuUsers.objects.get(osu_id='1')
+        self.assertEqual((existing.nick, existing.region, existing.cities), ('existing', 'SA', 'YAK'))
+        self.assertEqual(UnauthorizedOsuUsers.objects.get(osu_id='2').region, 'YEV')
+        self.assertFalse(UnauthorizedOsuUsers.objects.filter(osu_id='3').exists())
+        state = LeaderboardState.get()
+        self.assertTrue(state.rankings_dirty)
+        self.assertEqual(state.ranking_generation, 0)
+
+        scheduler = RefreshScheduler()
+        scheduler.maybe_rebuild()
+        self.assertFalse(LeaderboardState.get().rankings_dirty)
+        self.assertEqual(LeaderboardState.get().ranking_generation, 1)
+
+        with self.assertNumQueries(1), mock.patch('Leaderboard.googlesheet_service.parse_row') as parse_row:
+            self.assertTrue(parse_players())
+        parse_row.assert_not_called()
+
+        rows[1] = sheet_row(2, 'Приморский край')
+        responses.replace(responses.GET, self.url, body='\n'.join(rows))
+        UnauthorizedOsuUsers.objects.filter(osu_id='1').update(region='KHA')
+        self.assertTrue(parse_players())
+        self.assertEqual(UnauthorizedOsuUsers.objects.get(osu_id='2').region, 'PRI')
+        self.assertEqual(UnauthorizedOsuUsers.objects.get(osu_id='1').region, 'KHA')
@@ -1,17 +1,24 @@
 from rest_framework.permissions import AllowAny
 from Accounts.permissions import IsLinked, IsAuthenticated
-from django.db.models import Case, When, Value, IntegerField, F
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from .regions import CITIES
 from .models import OsuPerformance, ServerMember
 from .serializers import OsuPerformanceSerializer
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from django.db.models import Q
+from .ranking_service import order_leaderboard, get_ranking_scope, LEADERBOARD_USER_RELATED
+from .response_cache import cached_leaderboard_response
 from django.http import JsonResponse
 from DiscordBot.models import DiscordServer
 from Accounts.models import CustomUser
 from DiscordBot.serializers import DiscordServerSerializer
+import base64
+import json
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
@@ -21,30 +28,160 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class RankingPagination(StandardResultsSetPagination):
+    """
+    Пагинация по предрассчитанным позициям: страница N - диапазон позиций,
+    без OFFSET и COUNT(*). Формат ответа совпадает с PageNumberPagination.
+    """
+
+    def paginate_ranking(self, queryset, total, request):
+        self.request = request
+        self.total = total
+        page_size = self.get_page_size(request)
+        num_pages = max(1, math.ceil(total / page_size))
+        page_number = request.query_params.get(self.page_query_param) or 1
+        if page_number in self.last_page_strings:
+            page_number = num_pages
+        try:
+            page_number = int(page_number)
+        except (TypeError, ValueError):
+            page_number = 0
+        if not 1 <= page_number <= num_pages:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='Invalid page.'))
+
+        self.page_number = page_number
+        self.num_pages = num_pages
+        start = (page_number - 1) * page_size
+        return list(queryset.filter(position__gt=start, position__lte=start + page_size))
+
+    def get_next_link(self):
+        if self.page_number >= self.num_pages:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.total,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class LeaderboardCursorPagination(StandardResultsSetPagination):
+    """
+    Keyset-пагинация для бесконечной прокрутки по ключу (sort_priority, pp, global_rank, id).
+    Стоимость страницы не зависит от глубины, COUNT(*) не выполняется.
+    Включается параметром pagination=cursor или наличием cursor, total=1 добавляет
+    приблизительное количество из предрассчитанного рейтинга.
+    """
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+
+    @classmethod
+    def is_requested(cls, request):
+        return cls.cursor_query_param in request.query_params or request.query_params.get('pagination') == 'cursor'
+
+    @staticmethod
+    def encode_cursor(entry):
+        key = [entry.sort_priority, entry.pp, entry.global_rank, entry.id]
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            sort_priority, pp, global_rank, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return int(sort_priority), float(pp), None if global_rank is None else int(global_rank), int(entry_id)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    @staticmethod
+    def after(sort_priority, pp, global_rank, entry_id):
+        """Условие "строго после ключа" для порядка -sort_priority, -pp, global_rank nulls last, id"""
+        same_pp = Q(sort_priority=sort_priority, pp=pp)
+        if global_rank is None:
+            same_rank = same_pp & Q(global_rank__isnull=True)
+            later_rank = Q(pk__in=[])
+        else:
+            same_rank = same_pp & Q(global_rank=global_rank)
+            later_rank = same_pp & (Q(global_rank__gt=global_rank) | Q(global_rank__isnull=True))
+        return (
+            Q(sort_priority__lt=sort_priority)
+            | Q(sort_priority=sort_priority, pp__lt=pp)
+            | later_rank
+            | (same_rank & Q(id__gt=entry_id))
+        )
+
+    def paginate_keyset(self, queryset, request, approximate_total=None):
+        self.request = request
+        self.approximate_total = approximate_total
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(*self.decode_cursor(cursor)))
+
+        entries = list(queryset[:page_size + 1])
+        self.has_next = len(entries) > page_size
+        entries = entries[:page_size]
+        self.next_cursor = self.encode_cursor(entries[-1]) if self.has_next else None
+        return entries
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.request.query_params.get(self.total_query_param):
+            response['count'] = self.approximate_total
+        return Response(response)
+
+
+def leaderboard_response(request, entries, ranking):
+    """
+    Отдает страницу лидерборда: keyset-курсор по живым данным, если он запрошен,
+    иначе диапазон позиций из предрассчитанного рейтинга, иначе обычные страницы.
+    """
+    if LeaderboardCursorPagination.is_requested(request):
+        paginator = LeaderboardCursorPagination()
+        result_page = paginator.paginate_keyset(
+            order_leaderboard(entries), request, ranking[1] if ranking else None
+        )
+    elif ranking is not None:
+        queryset, total = ranking
+        paginator = RankingPagination()
+        result_page = [row.performance for row in paginator.paginate_ranking(queryset, total, request)]
+    else:
+        paginator = StandardResultsSetPagination()
+        result_page = paginator.paginate_queryset(order_leaderboard(entries), request)
+
+    serializer = OsuPerformanceSerializer(result_page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@cached_leaderboard_response()
 def get_mainboard(request):
     """
     Таблица по умолчанию на главной /leaderboards с пагинацией
     """
     try:
-        entries = OsuPerformance.objects.filter(mode="osu").select_related('user').annotate(
-            sort_priority=Case(
-                When(pp__gt=0, global_rank__isnull=False, then=Value(1)),
-                default=Value(0),
-                output_field=IntegerField()
-            )
-        ).order_by(
-            '-sort_priority',
-            '-pp',
-            F('global_rank').asc(nulls_last=True)
-        )
-
-        paginator = StandardResultsSetPagination()
-        result_page = paginator.paginate_queryset(entries, request)
-
-        serializer = OsuPerformanceSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        entries = OsuPerformance.objects.filter(mode="osu").select_related(*LEADERBOARD_USER_RELATED)
+        return leaderboard_response(request, entries, get_ranking_scope('osu'))
+    except APIException:
+        raise
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
@@ -66,11 +203,14 @@ def get_user_servers(request):
         serializer = DiscordServerSerializer(servers, many=True)
 
         return Response(serializer.data)
+    except APIException:
+        raise
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
 @api_view(['GET'])
 @permission_classes([IsLinked])
+@cached_leaderboard_response(private=True, skip_params=('server',))
 def get_leaderboard(request):
     """
     Таблица для авторизованных пользователей. Поддерживает фильтрацию.
@@ -79,6 +219,7 @@ def get_leaderboard(request):
     - region: код региона фильтрация по региону
     - city: код города фильтрация по городу
     - server: id сервера фильтрация по серверу
+    Пагинация: page/page_size или pagination=cursor/cursor для бесконечной прокрутки
     """
     logger.error(request.user.is_linked)
     try:
@@ -87,7 +228,7 @@ def get_leaderboard(request):
         city_code = request.GET.get('city', None)
         server_id = request.GET.get('server', None)
 
-        entries = OsuPerformance.objects.all().select_related('user')
+        entries = OsuPerformance.objects.all().select_related(*LEADERBOARD_USER_RELATED)
 
         entries = entries.filter(mode=mode)
 
@@ -105,29 +246,17 @@ def get_leaderboard(request):
             if city_code:
                 entries = entries.filter(user__cities=city_code)
 
-        entries = entries.annotate(
-            sort_priority=Case(
-                When(pp__gt=0, global_rank__isnull=False, then=Value(1)),
-                default=Value(0),
-                output_field=IntegerField()
-            )
-        ).order_by(
-            '-sort_priority',
-            '-pp',
-            F('global_rank').asc(nulls_last=True)
-        )
-
-        paginator = StandardResultsSetPagination()
-        result_page = paginator.paginate_queryset(entries, request)
-
-        serializer = OsuPerformanceSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        ranking = None if server_id else get_ranking_scope(mode, region_code, city_code)
+        return leaderboard_response(request, entries, ranking)
 
+    except APIException:
+        raise
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@cached_leaderboard_response(max_age=24 * 60 * 60, versioned=False)
 def get_cities(request):
     cities = [{'code': code, 'name': name} for code, name in CITIES]
     return JsonResponse({'cities': cities}, safe=False)
\ No newline at end of file
@@ -15,6 +15,10 @@ app.conf.beat_schedule = {
         'task': 'DiscordBot.tasks.parse_discord_servers',
         'schedule': crontab(hour=1),
     },
+    'sync-server-members-daily': {
+        'task': 'DiscordBot.tasks.sync_server_members',
+        'schedule': crontab(hour=1, minute=30),
+    },
     'parse-extension-daily': {
         'task': 'Leaderboard.tasks.parse_browser_extension',
         'schedule': crontab(hour=2),
@@ -23,6 +27,10 @@ app.conf.beat_schedule = {
         'task': 'Leaderboard.tasks.parse_google_sheet',
         'schedule': crontab(hour=3),
     },
+    'refresh-server-leaderboards': {
+        'task': 'Leaderboard.tasks.refresh_all_server_leaderboards',
+        'schedule': crontab(minute='*/30'),
+    },
 }
 
 app.conf.timezone = 'UTC'
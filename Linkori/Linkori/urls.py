@@ -12,5 +12,6 @@ urlpatterns = [
     path('api/token/verify/', custom_token_verify_view, name='token_verify'),
     path('accounts/', include('Accounts.urls')),
     path('leaderboard/', include('Leaderboard.urls')),
+    path('discord/', include('DiscordBot.urls')),
     re_path(r'^(?!static/|api/|accounts/|admin/).*$', TemplateView.as_view(template_name='index.html'), name='react_app'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file